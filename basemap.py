@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import geopandas as gpd
+import osmnx as ox
+import shapely
+
+from isochrones import PROJECTED_CRS, to_projected
+from render import add_polygons
+
+BASEMAP_DIR = "basemap"
+BASEMAP_VERSION = 1
+SUBURB_PLACE = "City of Melbourne, Victoria, Australia"
+
+# polygon layers and how they're drawn, bottom to top
+LAYERS = {
+    "buildings": {"tags": {"building": True}, "style": {"facecolor": "grey", "alpha": 0.6}},
+    "parks": {"tags": {"leisure": "park"}, "style": {"facecolor": "green", "alpha": 0.5}},
+    "water": {"tags": {"natural": "water"}, "style": {"facecolor": "blue", "alpha": 0.5}},
+}
+
+# simplification tolerances in meters; 0 is the untouched geometry
+TOLERANCES = (0, 1, 4, 16)
+ROW_GROUP_SIZE = 4096
+
+
+# ----------------------------
+# Build
+# ----------------------------
+def basemap_key(places, suburb_place=SUBURB_PLACE):
+    """Identity of a basemap: the places, the layer tags and the stored tolerances."""
+    ident = {
+        "version": BASEMAP_VERSION,
+        "places": places,
+        "suburbs": suburb_place,
+        "layers": {name: layer["tags"] for name, layer in LAYERS.items()},
+        "tolerances": TOLERANCES,
+    }
+    return hashlib.sha1(json.dumps(ident, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def fetch_layers(places, suburb_place=SUBURB_PLACE):
+    """Download the polygon layers and suburb boundaries from OSM."""
+    layers = {}
+    for name, layer in LAYERS.items():
+        layers[name] = ox.features_from_place(places, tags=layer["tags"])
+    layers["suburbs"] = ox.features_from_place(suburb_place, tags={"place": "suburb"})
+    return layers
+
+
+def build_basemap(places, root=BASEMAP_DIR, suburb_place=SUBURB_PLACE):
+    """Directory of the basemap for `places`, downloading and writing it on first use."""
+    directory = os.path.join(root, basemap_key(places, suburb_place))
+    if not os.path.exists(os.path.join(directory, "manifest.json")):
+        write_basemap(fetch_layers(places, suburb_place), directory)
+    return directory
+
+
+def write_basemap(layers, directory):
+    """Write every layer at every tolerance as GeoParquet, plus the suburb label points.
+
+    Rows are sorted along a Hilbert curve and written in small row groups with
+    a bbox covering column, so a bbox read only decodes the row groups that
+    touch the map. Coarser levels also drop polygons smaller than their
+    tolerance squared, which would be under a pixel anyway.
+    """
+    tmp = directory + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    counts = {}
+    for name in LAYERS:
+        polygons = _polygons(layers[name])
+        if polygons.empty:
+            counts[name] = {}
+            continue
+        polygons = polygons.iloc[np.argsort(polygons.hilbert_distance())]
+        projected = polygons.to_crs(PROJECTED_CRS).geometry
+
+        counts[name] = {}
+        for tolerance in TOLERANCES:
+            geoms = projected.simplify(tolerance) if tolerance else projected
+            keep = (~geoms.is_empty & (geoms.area >= tolerance ** 2)).to_numpy()
+            level = gpd.GeoDataFrame(geometry=geoms[keep].to_crs("EPSG:4326").to_numpy(), crs="EPSG:4326")
+            level.to_parquet(
+                os.path.join(tmp, f"{name}_{tolerance}.parquet"),
+                index=False, write_covering_bbox=True, row_group_size=ROW_GROUP_SIZE,
+            )
+            counts[name][tolerance] = len(level)
+
+    # label points come from the projected centroid, which is stable for odd-shaped suburbs
+    suburbs = _polygons(layers["suburbs"])
+    labels = gpd.GeoDataFrame(
+        {"name": suburbs["name"].to_numpy() if "name" in suburbs else np.full(len(suburbs), "")},
+        geometry=suburbs.to_crs(PROJECTED_CRS).centroid.to_crs("EPSG:4326").to_numpy(),
+        crs="EPSG:4326",
+    )
+    labels.to_parquet(os.path.join(tmp, "labels.parquet"), index=False, write_covering_bbox=True)
+
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump({"version": BASEMAP_VERSION, "tolerances": TOLERANCES, "counts": counts}, f, indent=1)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp, directory)
+
+
+def _polygons(gdf):
+    return gdf[gdf.geom_type.isin(["Polygon", "MultiPolygon"])]
+
+
+# ----------------------------
+# Load
+# ----------------------------
+def pick_tolerance(meters_per_pixel):
+    """Coarsest stored tolerance that stays under half a pixel."""
+    return max(t for t in TOLERANCES if t <= meters_per_pixel / 2)
+
+
+def meters_per_pixel(ax, dpi):
+    """Ground size of one output pixel across the axes' current x extent."""
+    (x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
+    px, _ = to_projected([x0, x1], [(y0 + y1) / 2] * 2)
+    width_px = ax.get_window_extent().width / ax.figure.dpi * dpi
+    return abs(px[1] - px[0]) / width_px
+
+
+def load_basemap(directory, bbox, meters_per_pixel=0.0):
+    """Layers clipped to `bbox` (lon/lat minx, miny, maxx, maxy) at the right simplification.
+
+    Returns {layer: GeoDataFrame} for every polygon layer plus "labels".
+    """
+    tolerance = pick_tolerance(meters_per_pixel)
+    basemap = {}
+    for name in LAYERS:
+        path = os.path.join(directory, f"{name}_{tolerance}.parquet")
+        basemap[name] = gpd.read_parquet(path, bbox=bbox) if os.path.exists(path) else gpd.GeoDataFrame(geometry=[])
+    basemap["labels"] = gpd.read_parquet(os.path.join(directory, "labels.parquet"), bbox=bbox)
+    return basemap
+
+
+def draw_basemap(ax, basemap, fontsize=8):
+    """Plot the polygon layers under the network and annotate the suburbs."""
+    for name, layer in LAYERS.items():
+        if not basemap[name].empty:
+            add_polygons(ax, basemap[name].geometry.values, zorder=0, **layer["style"])
+
+    labels = basemap["labels"]
+    xs, ys = shapely.get_x(labels.geometry.values), shapely.get_y(labels.geometry.values)
+    for name, x, y in zip(labels["name"], xs, ys):
+        ax.annotate(text=name, xy=(x, y), fontsize=fontsize, ha="center")
@@ -0,0 +1,279 @@
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import matplotlib.pyplot as plt
+import networkx as nx
+import osmnx as ox
+from scipy.spatial import cKDTree
+
+from graph_plot import plot_graph
+from isochrones import HULL_MODES, ring_polygon
+from parallel_rings import compute_rings
+from render import draw_rings
+from ring_engine import compile_graph, generate_ring, reachable
+from signal_delays import add_profiles, attach_volumes, snap_signals
+
+PROFILES = {
+    "offpeak": {"volume": "offpeak_volume", "per_vehicle": 1 / 200.0, "cap": 120, "default": 10},
+    "peak": {"volume": "peak_volume", "per_vehicle": 1 / 200.0, "cap": 120, "default": 10},
+}
+SPEEDS = {"motorway": 100, "trunk": 80, "primary": 60, "secondary": 50, "tertiary": 50, "residential": 40,
+          "service": 20}
+ORIGIN = (144.90, -37.85)  # synthetic graphs are laid out north-east of here
+M_PER_DEG_LAT = 110_540
+M_PER_DEG_LON = 111_320 * np.cos(np.deg2rad(ORIGIN[1]))
+
+
+# ----------------------------
+# Graphs
+# ----------------------------
+def cached_graphs(pattern="cache_*/*.json"):
+    """Drive graphs rebuilt offline from the committed Overpass responses that hold streets.
+
+    Goes through osmnx's internal _create_graph, which is what graph_from_place
+    runs on the responses after downloading them.
+    """
+    graphs, seen = {}, set()
+    for path in sorted(glob.glob(pattern)):
+        name = os.path.basename(path)
+        if name in seen:
+            continue
+        with open(path) as f:
+            response = json.load(f)
+        if not isinstance(response, dict):
+            continue  # geocoder result, not an Overpass response
+        if not any("highway" in e.get("tags", {}) for e in response.get("elements", []) if e["type"] == "way"):
+            continue
+        seen.add(name)
+        G = ox.simplify_graph(ox.graph._create_graph([response], bidirectional=False))
+        ox.routing.add_edge_speeds(G, hwy_speeds=SPEEDS, fallback=40)
+        ox.routing.add_edge_travel_times(G)
+        graphs[f"osm_{name[:8]}"] = G
+    return graphs
+
+
+def _road_graph(x, y, pairs, rng):
+    """Two-way MultiDiGraph over meter coordinates with lengths, speeds and travel times."""
+    G = nx.MultiDiGraph(crs="EPSG:4326")
+    lon, lat = ORIGIN[0] + x / M_PER_DEG_LON, ORIGIN[1] + y / M_PER_DEG_LAT
+    G.add_nodes_from((i, {"x": lon[i], "y": lat[i]}) for i in range(len(x)))
+    highway = rng.choice(["residential", "secondary", "primary"], size=len(pairs), p=[0.7, 0.2, 0.1])
+    for (u, v), hw in zip(pairs, highway):
+        length = float(np.hypot(x[u] - x[v], y[u] - y[v]))
+        travel_time = length / (SPEEDS[hw] / 3.6)
+        G.add_edge(u, v, length=length, highway=hw, travel_time=travel_time)
+        G.add_edge(v, u, length=length, highway=hw, travel_time=travel_time)
+    return G
+
+
+def grid_graph(side, spacing=100.0, seed=0):
+    """side x side street grid with a little positional noise."""
+    rng = np.random.default_rng(seed)
+    i, j = np.divmod(np.arange(side * side), side)
+    x = j * spacing + rng.normal(0, spacing / 20, side * side)
+    y = i * spacing + rng.normal(0, spacing / 20, side * side)
+    node = np.arange(side * side).reshape(side, side)
+    pairs = np.concatenate([
+        np.column_stack([node[:, :-1].ravel(), node[:, 1:].ravel()]),
+        np.column_stack([node[:-1, :].ravel(), node[1:, :].ravel()]),
+    ])
+    return _road_graph(x, y, pairs, rng)
+
+
+def geometric_graph(n, spacing=100.0, degree=3.0, seed=0):
+    """n random junctions linked to every other junction within the radius giving ~`degree` links each."""
+    rng = np.random.default_rng(seed)
+    side = np.sqrt(n) * spacing
+    x, y = rng.uniform(0, side, n), rng.uniform(0, side, n)
+    radius = np.sqrt(degree / (np.pi * n / side ** 2))
+    pairs = np.array(sorted(cKDTree(np.column_stack([x, y])).query_pairs(radius)), dtype=np.int64).reshape(-1, 2)
+    return _road_graph(x, y, pairs, rng)
+
+
+# ----------------------------
+# Synthetic Signals
+# ----------------------------
+def synthetic_signals(G, directory, share=0.05, seed=0):
+    """Traffic lights near a share of the nodes and a volume summary for most of them, as files."""
+    rng = np.random.default_rng(seed)
+    nodes = list(G.nodes)
+    picked = rng.choice(len(nodes), max(1, int(len(nodes) * share)), replace=False)
+    lon = np.array([G.nodes[nodes[i]]["x"] for i in picked]) + rng.normal(0, 10 / M_PER_DEG_LON, len(picked))
+    lat = np.array([G.nodes[nodes[i]]["y"] for i in picked]) + rng.normal(0, 10 / M_PER_DEG_LAT, len(picked))
+    site_no = np.arange(1, len(picked) + 1)
+    lights = gpd.GeoDataFrame({"SITE_NO": site_no}, geometry=gpd.points_from_xy(lon, lat), crs="EPSG:4326")
+
+    with_data = site_no[rng.random(len(site_no)) < 0.9]
+    offpeak = rng.uniform(500, 8000, len(with_data)).round()
+    volumes = pd.DataFrame({"NB_SCATS_SITE": with_data, "offpeak_volume": offpeak,
+                            "peak_volume": (offpeak * rng.uniform(1.2, 2.0, len(with_data))).round()})
+    volume_csv = os.path.join(directory, "volumes.csv")
+    volumes.to_csv(volume_csv, index=False)
+    return lights, volume_csv
+
+
+# ----------------------------
+# Stages
+# ----------------------------
+def best_of(fn, repeat):
+    """Smallest wall time of `repeat` calls, and the last result."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_graph(name, G, args, directory):
+    """Time every pipeline stage on one graph; returns result rows."""
+    rng = np.random.default_rng(0)
+    rows = []
+
+    def record(stage, seconds, per=1):
+        rows.append({"graph": name, "stage": stage, "seconds": seconds / per, "per": per,
+                     "nodes": G.number_of_nodes(), "edges": G.number_of_edges()})
+
+    lights, volume_csv = synthetic_signals(G, directory)
+    t, cg = best_of(lambda: compile_graph(G), args.repeat)
+    record("compile", t)
+    t, mapping = best_of(lambda: snap_signals(cg, lights), args.repeat)
+    record("snap", t)
+    t, _ = best_of(lambda: attach_volumes(cg, mapping, volume_csv), args.repeat)
+    record("volumes", t)
+    t, _ = best_of(lambda: add_profiles(cg, PROFILES), args.repeat)
+    record("delays", t)
+
+    nodes = cg.node_ids[rng.choice(cg.n_nodes, min(args.rings, cg.n_nodes), replace=False)].tolist()
+    t, _ = best_of(lambda: [reachable(cg, n, args.cutoff, "peak") for n in nodes], args.repeat)
+    record("search", t, per=len(nodes))
+    t, _ = best_of(lambda: [generate_ring(cg, n, args.cutoff, "peak") for n in nodes], args.repeat)
+    record("ring", t, per=len(nodes))
+    t, rings = best_of(lambda: compute_rings(cg, nodes, args.cutoff, "peak", workers=args.workers), args.repeat)
+    record("rings_batch", t, per=len(nodes))
+
+    reached = [reachable(cg, n, args.cutoff, "peak")[0] for n in nodes[: args.hulls]]
+    for mode in HULL_MODES:
+        t, _ = best_of(lambda: [ring_polygon(cg, idx, mode) for idx in reached], args.repeat)
+        record(f"hull_{mode}", t, per=len(reached))
+
+    def render():
+        fig, ax = plot_graph(cg)
+        draw_rings(ax, rings)
+        fig.savefig(io.BytesIO(), dpi=args.dpi)
+        plt.close(fig)
+
+    t, _ = best_of(render, args.repeat)
+    record("render", t)
+    return rows
+
+
+# ----------------------------
+# Memory
+# ----------------------------
+def networkx_bytes(G):
+    """Bytes held by a networkx graph's dicts, keys and attribute values (shared objects counted once).
+
+    Geometries count only their Python wrapper, so this is a lower bound.
+    """
+    seen, total = set(), 0
+    stack = [G.graph, G._node, G._adj] + ([G._pred] if G.is_directed() else [])
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set)):
+            stack.extend(obj)
+    return total
+
+
+def memory_report(name, G):
+    """Bytes per edge of the networkx graph, the compiled graph and its float32 compact copy."""
+    cg = compile_graph(G)
+    sizes = {"networkx": networkx_bytes(G), "compiled": sum(cg.nbytes().values()),
+             "compact": sum(cg.compact().nbytes().values())}
+    edges = max(G.number_of_edges(), 1)
+    return {"graph": name, "edges": G.number_of_edges(), **{k: v / edges for k, v in sizes.items()}}
+
+
+# ----------------------------
+# Regression Check
+# ----------------------------
+def regressions(rows, baseline, max_ratio, min_delta):
+    """Rows slower than `max_ratio` x baseline and by more than `min_delta` seconds (noise floor)."""
+    before = {(r["graph"], r["stage"]): r["seconds"] for r in baseline["results"]}
+    slow = []
+    for r in rows:
+        old = before.get((r["graph"], r["stage"]))
+        if old is not None and r["seconds"] > old * max_ratio and r["seconds"] - old > min_delta:
+            slow.append({**r, "baseline": old, "ratio": r["seconds"] / old})
+    return slow
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the graph, ring and plotting stages.")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[30, 60, 120],
+                        help="synthetic graph sizes, as grid side length (nodes = side^2)")
+    parser.add_argument("--no-cached", action="store_true", help="skip the graphs rebuilt from cache_*/")
+    parser.add_argument("--rings", type=int, default=20, help="sources per ring stage")
+    parser.add_argument("--hulls", type=int, default=5, help="reached sets per hull mode")
+    parser.add_argument("--cutoff", type=float, default=10 * 60)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="earlier --output to compare against; exit 1 on a regression")
+    parser.add_argument("--max-ratio", type=float, default=1.5)
+    parser.add_argument("--min-delta", type=float, default=0.005, help="ignore slowdowns under this many seconds")
+    args = parser.parse_args()
+
+    graphs = {} if args.no_cached else cached_graphs()
+    for side in args.sizes:
+        graphs[f"grid_{side * side}"] = grid_graph(side)
+        graphs[f"geometric_{side * side}"] = geometric_graph(side * side)
+
+    rows, memory = [], []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, G in graphs.items():
+            graph_rows = bench_graph(name, G, args, directory)
+            rows.extend(graph_rows)
+            memory.append(memory_report(name, G))
+            print(f"{name} ({G.number_of_nodes():,} nodes, {G.number_of_edges():,} edges)")
+            for r in graph_rows:
+                print(f"  {r['stage']:<14} {r['seconds'] * 1000:10.2f} ms" + (f"  per item of {r['per']}" if r["per"] > 1 else ""))
+            m = memory[-1]
+            print(f"  bytes per edge: networkx {m['networkx']:,.0f}, compiled {m['compiled']:,.0f}, "
+                  f"compact {m['compact']:,.0f}")
+
+    report = {
+        "meta": {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)},
+        "results": rows,
+        "memory": memory,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Saved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slow = regressions(rows, json.load(f), args.max_ratio, args.min_delta)
+        for r in slow:
+            print(f"REGRESSION {r['graph']} {r['stage']}: {r['seconds'] * 1000:.2f} ms vs "
+                  f"{r['baseline'] * 1000:.2f} ms ({r['ratio']:.2f}x)")
+        sys.exit(1 if slow else 0)
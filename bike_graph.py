@@ -1,183 +1,196 @@
+import os
 import osmnx as ox, networkx as nx
 import matplotlib.pyplot as plt
-from shapely.geometry import Point
-import geopandas as gpd
-import pandas as pd
-
+import numpy as np
+
+from basemap import build_basemap, draw_basemap, load_basemap, meters_per_pixel
+from graph_plot import plot_graph
+from graph_snapshot import load_snapshot, reweight_snapshot, save_snapshot, snapshot_key
+from instrument import enabled, stage, timed, write_report, write_trace
+from osm_extract import EXTRACT_VERSION, graph_from_extract
+from parallel_rings import compute_bands, compute_rings, facility_report, fan_out, prepare_facilities
+from render import StageTimer, draw_rings
+from ring_cache import RingCache
+from ring_engine import compile_graph
+from signal_delays import add_profiles, attach_volumes, snap_signals
+from tiles import with_tiles
+from web_export import export_web_map
 
 
 # ----------------------------
 # Graph Setup
 # ----------------------------
-def graph_init(places, traffic_geojson, volume_csv):
-    """Initialise graph, speeds, travel times, and inject delays."""
-
-    ox.settings.cache_folder = "cache_bike"
-
-    G = ox.graph_from_place(places, network_type="bike")
-
-    nx.set_edge_attributes(G, 15, "speed_kph")
-    ox.routing.add_edge_travel_times(G)
-
-    # Load traffic lights + volumes
-    traffic_lights = gpd.read_file(traffic_geojson)
-    volume_df = pd.read_csv(volume_csv)
-    volume_dict = volume_df.set_index("NB_SCATS_SITE")[
-        ["offpeak_volume", "peak_volume"]
-    ].to_dict("index")
-
-    # Attach delays to nodes
-    for _, row in traffic_lights.iterrows():
-        lon, lat = row["geometry"].x, row["geometry"].y
-        nearest_node = ox.distance.nearest_nodes(G, lon, lat)
-        G.nodes[nearest_node]["site_no"] = row["SITE_NO"]
-
-        vols = volume_dict.get(row["SITE_NO"])
-        if vols:
-            G.nodes[nearest_node]["offpeak_volume"] = vols["offpeak_volume"]
-            G.nodes[nearest_node]["peak_volume"] = vols["peak_volume"]
-        else:
-            G.nodes[nearest_node]["offpeak_volume"] = 0
-            G.nodes[nearest_node]["peak_volume"] = 0
-
-    # Apply delays to edges
-    for node, data in G.nodes(data=True):
-        if "peak_volume" in data and data["peak_volume"] > 0:
-            delay = 30
-        else:
-            delay = 5  # unsignalised default
-
-        for u, v, k in G.in_edges(node, keys=True):
-            G[u][v][k]["travel_time"] += delay
-        for u, v, k in G.out_edges(node, keys=True):
-            G[u][v][k]["travel_time"] += delay
-
-    return G
-
-# ----------------------------
-# Ring Generator
-# ----------------------------
-def generate_ring(G, node, cutoff=20*60):
-    lengths = nx.single_source_dijkstra_path_length(
-        G, node, cutoff=cutoff, weight="travel_time"
-    )
-    if not lengths:
-        return [], gpd.GeoDataFrame(geometry=[])
-
-    reachable_nodes = list(lengths.keys())
-    points = [Point((G.nodes[n]["x"], G.nodes[n]["y"])) for n in reachable_nodes]
-    gdf = gpd.GeoDataFrame(geometry=points, crs="EPSG:4326")
-
-    gdf_proj = gdf.to_crs(epsg=32755)  # meters
-    if gdf_proj.empty:
-        return reachable_nodes, gpd.GeoDataFrame(geometry=[])
-
-    hull = gdf_proj.buffer(150).union_all().convex_hull
-    if hull.is_empty:
-        return reachable_nodes, gpd.GeoDataFrame(geometry=[])
-
-    hull_gdf = gpd.GeoDataFrame(geometry=[hull], crs=gdf_proj.crs).to_crs(epsg=4326)
-    return reachable_nodes, hull_gdf
-
+@timed()
+def graph_init(places, traffic_geojson, volume_csv, extra_profiles=None, extract=None, tile_size=None,
+               compact=False):
+    """Initialise graph, speeds, travel times, and one weight profile per delay scenario.
+
+    With `extract` (a local .osm/.osm.pbf file) the graph is built from it
+    offline instead of being downloaded for `places`. With `tile_size`
+    (meters) the graph is also cut into cells on disk, and rings load only
+    the cells their search can reach (see tiles.TiledGraph). The cells are
+    cut from the finished graph, so a cold build still holds all of it in
+    memory, plus the osmnx networkx graph unless `extract` is given; warm
+    starts memory-map the snapshot and read cells as searches reach them.
+    With `compact` coordinates and weights are stored as float32 (see
+    CompiledGraph.compact).
+    """
+
+    # Signal delay per profile: flat 30 s at busy lights, 5 s unsignalised.
+    # Extra profiles can use any other column of the volume summary.
+    profiles = {
+        "offpeak": {"volume": "offpeak_volume", "fixed": 30, "default": 5},
+        "peak": {"volume": "peak_volume", "fixed": 30, "default": 5},
+        **(extra_profiles or {}),
+    }
+
+    # Reuse the finished graph while none of its inputs have changed
+    settings = {"profiles": profiles, "speed_kph": 15}
+    if compact:
+        settings["compact"] = True
+    sources = [traffic_geojson] + ([extract] if extract else [])
+    if extract:
+        settings["extract_version"] = EXTRACT_VERSION  # snapshots from older extract builds are not reused
+    key = snapshot_key(places, "bike", settings, sources + [volume_csv])
+    base_key = snapshot_key(places, "bike", settings, sources)
+    with stage("load_snapshot"):
+        engine = load_snapshot(key)
+    if engine is not None:
+        return with_tiles(engine, tile_size)
+
+    # Only the volume summary changed: patch the delays of the last build in place
+    with stage("reweight"):
+        engine = reweight_snapshot(base_key, key, volume_csv, profiles)
+    if engine is not None:
+        return with_tiles(engine, tile_size)
+
+    if extract:
+        with stage("graph_from_extract"):
+            engine = graph_from_extract(extract, "bike", speed_kph=15)
+    else:
+        ox.settings.cache_folder = "cache_bike"
+
+        with stage("graph_from_place"):
+            G = ox.graph_from_place(places, network_type="bike")
+
+        with stage("speeds"):
+            nx.set_edge_attributes(G, 15, "speed_kph")
+            ox.routing.add_edge_travel_times(G)
+
+        with stage("compile"):
+            engine = compile_graph(G)
+
+    # Snap all traffic lights in one query and join their volumes
+    with stage("snap"):
+        signals = snap_signals(engine, traffic_geojson, "TrafficLight_Node_Mapping_bike.csv")
+    with stage("volumes"):
+        attach_volumes(engine, signals, volume_csv)
+
+    # free_flow keeps the raw travel times; each profile adds its own delays
+    with stage("delays"):
+        add_profiles(engine, profiles)
+
+    if compact:
+        engine = engine.compact()
+    with stage("save_snapshot"):
+        save_snapshot(engine, key, meta={"places": places, "network_type": "bike", "base_key": base_key})
+    return with_tiles(engine, tile_size)
 
 # ----------------------------
 # Multi-Plot
 # ----------------------------
-def plot_all_rings(G, features, cutoff=20*60):
-    """Plot all school rings on one map."""
-    edge_colors = []
-    for u, v, k, data in G.edges(keys=True, data=True):
-        if data.get("highway") in ["cycleway", "path", "track"]:
-            edge_colors.append("maroon")   # cycle-dedicated
-        else:
-            edge_colors.append("dimgray") 
-
-    fig, ax = ox.plot_graph(
-        G,
-        bgcolor="lightgrey",
-        node_size=0,
-        node_color="lightgrey",
-        edge_color=edge_colors,
-        show=False,
-        close=False,
-    )
-
-    # --- get polygons ---
-    # Buildings
-    buildings = ox.features_from_place(places, tags={"building": True})
-    # Parks/green space
-    parks = ox.features_from_place(places, tags={"leisure": "park"})
-    # Water (rivers, lakes)
-    water = ox.features_from_place(places, tags={"natural": "water"})
-    #filter for polygons
-    parks = parks[parks.geom_type.isin(["Polygon", "MultiPolygon"])]
-    water = water[water.geom_type.isin(["Polygon", "MultiPolygon"])]
-    buildings = buildings[buildings.geom_type.isin(["Polygon", "MultiPolygon"])]
-
-    suburbs = ox.features_from_place(
-    "City of Melbourne, Victoria, Australia",
-    tags={"place": "suburb"}
-    )
-    suburbs = suburbs[suburbs.geom_type.isin(["Polygon", "MultiPolygon"])]
-    for idx, row in suburbs.iterrows():
-        centroid = row.geometry.centroid
-        ax.annotate(
-            text=row["name"], 
-            xy=(centroid.x, centroid.y),
-            fontsize=8,
-            ha="center"
+@timed()
+def plot_all_rings(engine, features, cutoff=20*60, profile="peak", hull_mode="convex", workers=None, cache=None,
+                   bands=None, dpi=300, web_budget=None, output="Saved_Plots/bike_schools_{profile}_map.png"):
+    """Plot all school rings for one weight profile on one map, saved to `output`.
+
+    Pass `bands` (cutoffs in seconds, e.g. 5/10/15/20 min) to draw graded
+    nested bands from one search per school instead of a single ring.
+    Pass a list of profiles to export one map per profile in a single pass;
+    the network, basemap and markers are drawn once and shared. Returns the
+    StageTimer with the time spent in each stage, and in its
+    info["facilities"] the snap distances and how many facilities shared a
+    node (each node is searched once). With `web_budget` (bytes) an
+    interactive HTML map is written next to each PNG as well. `output` is
+    formatted with the profile name.
+    """
+    highway = engine.edge_labels("highway")
+    edge_colors = np.where(
+        np.isin(highway, ["cycleway", "path", "track"]),
+        "maroon",   # cycle-dedicated
+        "dimgray",
+    ).tolist()
+
+    timer = StageTimer()
+    profiles = [profile] if isinstance(profile, str) else list(profile)
+
+    with timer("network"):
+        fig, ax = plot_graph(
+            engine,
+            bgcolor="lightgrey",
+            edge_color=edge_colors,
         )
 
-    # --- plot polygons ---
-    if not buildings.empty:
-        buildings.plot(ax=ax, facecolor="grey", edgecolor="none", alpha=0.6, zorder=0)
-    if not parks.empty:
-        parks.plot(ax=ax, facecolor="green", edgecolor="none", alpha=0.5, zorder=0)
-    if not water.empty:
-        water.plot(ax=ax, facecolor="blue", edgecolor="none", alpha=0.5, zorder=0)
-
-    # loop over features
-    for idx, row in features.iterrows():
-        centroid = row.geometry.centroid
-        lon, lat = centroid.x, centroid.y
-        node = ox.distance.nearest_nodes(G, lon, lat)
-
-        reachable_nodes, hull_gdf = generate_ring(G, node, cutoff=cutoff)
-
-        # hull outline
-        if not hull_gdf.empty and hull_gdf.iloc[0].geometry.geom_type == "Polygon":
-            hull_gdf.plot(
-                ax=ax,
-                facecolor="blue",   # fill color
-                edgecolor="darkblue",
-                alpha=0.10,         # transparency (0=fully transparent, 1=solid)
-                linewidth=1.5,
-                zorder=3
-            )
-        # school marker
-        ax.scatter(
-            lon, lat,
-            c="red", s=20,
-            edgecolors="white", linewidth=0.8,
-            zorder=5
-        )
-
-    plt.savefig("Saved_Plots/bike_schools_peak_map.png", dpi=300, bbox_inches="tight")
-    plt.show()
-
-
-places = ["City of Melbourne, Victoria, Australia"]
-
-# 1. Build graph with traffic delays
-G = graph_init(places, "Traffic_Lights.geojson", "Traffic_Volumes_Summary.csv")
-
-# 2. Get schools (could later swap for hospitals, shops, etc.)
-schools = ox.features_from_place(places, {"amenity": "school", "isced:level": "1"})
-schools =schools[schools["name"].str.contains("Primary", case=False, na=False)] # filter for primary
-schools = schools.to_crs(epsg=32755)
-schools["geometry"] = schools.centroid.to_crs(epsg=4326)
-
-# 3. Plot all schools + all their 20min rings
-plot_all_rings(G, schools, cutoff=10*60)
-
-
+    # --- basemap: built once per place, then read back clipped and simplified for this map ---
+    with timer("basemap"):
+        (x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
+        basemap = load_basemap(build_basemap(engine.meta["places"]), (x0, y0, x1, y1), meters_per_pixel(ax, dpi))
+        draw_basemap(ax, basemap)
+
+    # snap every feature at once and search once per distinct node; mark them all with one scatter
+    with timer("snap"):
+        facilities, nodes = prepare_facilities(engine, features)
+        lons, lats = facilities["lon"].to_numpy(), facilities["lat"].to_numpy()
+    timer.info["facilities"] = facility_report(facilities)
+    with timer("markers"):
+        ax.scatter(lons, lats, c="red", s=20, edgecolors="white", linewidth=0.8, zorder=5)
+    band_colors = plt.get_cmap("Blues_r")(np.linspace(0.1, 0.7, len(bands))) if bands else None  # darkest = closest
+
+    # one map per profile on the same base layers: compute the rings across cores, draw them
+    # as a single collection, render, then lift them off again for the next profile
+    for profile in profiles:
+        with timer("rings"):
+            if bands:
+                rings = compute_bands(engine, nodes, cutoffs=bands, profile=profile, mode=hull_mode, workers=workers)
+            else:
+                rings = compute_rings(
+                    engine, nodes, cutoff=cutoff, profile=profile, mode=hull_mode, workers=workers, cache=cache
+                )
+        with timer("hulls"):
+            hulls = draw_rings(ax, rings, band_colors)
+        with timer("save"):
+            fig.savefig(output.format(profile=profile), dpi=dpi, bbox_inches="tight")
+        if web_budget:
+            with timer("web"):
+                html = os.path.splitext(output.format(profile=profile))[0] + ".html"
+                export_web_map(engine, lons, lats, fan_out(rings, facilities), html, web_budget)
+        hulls.remove()
+
+    plt.close(fig)
+    return timer
+
+
+if __name__ == "__main__":
+    places = ["City of Melbourne, Victoria, Australia"]
+
+    # 1. Build graph with traffic delays
+    engine = graph_init(places, "Traffic_Lights.geojson", "Traffic_Volumes_Summary.csv")
+
+    # 2. Get schools (could later swap for hospitals, shops, etc.)
+    schools = ox.features_from_place(places, {"amenity": "school", "isced:level": "1"})
+    schools =schools[schools["name"].str.contains("Primary", case=False, na=False)] # filter for primary
+    schools = schools.to_crs(epsg=32755)
+    schools["geometry"] = schools.centroid.to_crs(epsg=4326)
+
+    # 3. Plot all schools + all their 20min rings
+    # rings are cached per graph/profile/cutoff, so re-styling a map skips the searches
+    cache = RingCache()
+    timer = plot_all_rings(engine, schools, cutoff=10*60, profile="peak", cache=cache)
+    print("ring cache:", cache.stats())
+    print("facilities:", timer.info["facilities"])
+    print(timer.report())
+
+    # FLOWCATION_PROFILE=1 records every stage of the run
+    if enabled():
+        write_report("Saved_Plots/bike_run_profile.json")
+        write_trace("Saved_Plots/bike_run_profile.folded")
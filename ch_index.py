@@ -0,0 +1,308 @@
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+from graph_snapshot import SNAPSHOT_DIR, load_snapshot
+from ring_engine import NodeIndex
+
+WITNESS_SETTLE_LIMIT = 200  # nodes a witness search may settle before giving up (and adding the shortcut)
+
+
+# ----------------------------
+# Contraction Hierarchy
+# ----------------------------
+class ContractionHierarchy:
+    """Upward and downward edges of a contraction hierarchy over one weight profile.
+
+    `up` holds, per node, the edges to higher-ranked nodes (original edges and
+    shortcuts); `down` holds, per node, the edges arriving from higher-ranked
+    nodes, stored at the lower end so the backward search also only climbs.
+    Both are CSR triples (indptr, indices, weights) over node indices.
+    """
+
+    def __init__(self, rank, up, down, node_ids, info=None):
+        self.rank = np.asarray(rank)
+        self.up = up
+        self.down = down
+        self.node_ids = np.asarray(node_ids)
+        self.node_index = NodeIndex(self.node_ids)
+        self.info = dict(info or {})
+        self._lists = None
+
+    @property
+    def n_nodes(self):
+        return len(self.rank)
+
+    @property
+    def n_edges(self):
+        return len(self.up[1]) + len(self.down[1])
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.rank, *self.up, *self.down))
+
+    def _adjacency(self):
+        # plain lists make the per-query heap loop several times faster than indexing arrays
+        if self._lists is None:
+            self._lists = tuple(
+                [list(zip(indices[indptr[i]:indptr[i + 1]].tolist(), weights[indptr[i]:indptr[i + 1]].tolist()))
+                 for i in range(self.n_nodes)]
+                for indptr, indices, weights in (
+                    (np.asarray(p), np.asarray(ix), np.asarray(w)) for p, ix, w in (self.up, self.down)
+                )
+            )
+        return self._lists
+
+    def query(self, source, target):
+        """Travel time (s) from node index `source` to node index `target`, inf if unreachable."""
+        if source == target:
+            return 0.0
+        adjacency = self._adjacency()
+        dist = ({source: 0.0}, {target: 0.0})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        best = np.inf
+        while True:
+            # expand whichever side has the closer frontier; both only climb in rank
+            tops = [h[0][0] if h else np.inf for h in heaps]
+            side = 0 if tops[0] <= tops[1] else 1
+            if tops[side] >= best:
+                return best
+            d, u = heapq.heappop(heaps[side])
+            if d > dist[side][u]:
+                continue
+            other = dist[1 - side].get(u)
+            if other is not None and d + other < best:
+                best = d + other
+            mine = dist[side]
+            for v, w in adjacency[side][u]:
+                nd = d + w
+                if nd < mine.get(v, np.inf):
+                    mine[v] = nd
+                    heapq.heappush(heaps[side], (nd, v))
+
+    def travel_time(self, origin, destination):
+        """Travel time (s) between two OSM node ids."""
+        return self.query(self.node_index[int(origin)], self.node_index[int(destination)])
+
+
+def _witness(out_adj, source, skip, targets, limit, max_settled):
+    """Upper bounds on source -> targets distances that avoid `skip`, searched up to `limit`."""
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    remaining = set(targets)
+    settled = 0
+    while heap and remaining and settled < max_settled:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        if d > limit:
+            break
+        remaining.discard(u)
+        settled += 1
+        for v, w in out_adj[u].items():
+            if v == skip:
+                continue
+            nd = d + w
+            if nd < dist.get(v, np.inf):
+                dist[v] = nd
+                heapq.heappush(heap, (nd, v))
+    return dist
+
+
+def _shortcuts(out_adj, in_adj, v, max_settled):
+    """Shortcuts needed to contract v: (u, x, weight) for every u -> v -> x with no path as short around v."""
+    outs = out_adj[v]
+    needed = []
+    for u, wu in in_adj[v].items():
+        targets = [x for x in outs if x != u]
+        if not targets:
+            continue
+        limit = wu + max(outs[x] for x in targets)
+        dist = _witness(out_adj, u, v, targets, limit, max_settled)
+        for x in targets:
+            via = wu + outs[x]
+            if dist.get(x, np.inf) > via:
+                needed.append((u, x, via))
+    return needed
+
+
+def _csr(rows, n):
+    """(indptr, indices int32, weights float64) from per-node {neighbour: weight} dicts."""
+    counts = np.fromiter((len(r) for r in rows), dtype=np.int64, count=n)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    indices = np.fromiter((k for r in rows for k in r), dtype=np.int32, count=indptr[-1])
+    weights = np.fromiter((w for r in rows for w in r.values()), dtype=np.float64, count=indptr[-1])
+    return indptr, indices, weights
+
+
+def build_ch(cg, profile="free_flow", max_settled=WITNESS_SETTLE_LIMIT):
+    """Contract every node of `cg` in edge-difference order and return the hierarchy.
+
+    Priorities are updated lazily: a node is re-scored when popped and put back
+    if it no longer beats the next one, and its neighbours are re-scored after
+    each contraction. A witness search cut short by `max_settled` only ever
+    adds an unneeded shortcut, so answers stay exact.
+    """
+    start = time.perf_counter()
+    matrix = cg.matrix(profile).tocoo()
+    n = cg.n_nodes
+    out_adj = [{} for _ in range(n)]
+    in_adj = [{} for _ in range(n)]
+    for u, v, w in zip(matrix.row.tolist(), matrix.col.tolist(), matrix.data.tolist()):
+        if u != v:
+            out_adj[u][v] = w
+            in_adj[v][u] = w
+
+    deleted = np.zeros(n, dtype=np.int64)
+    rank = np.full(n, -1, dtype=np.int32)
+    up = [None] * n
+    down = [None] * n
+    added = 0
+
+    def priority(v):
+        return len(_shortcuts(out_adj, in_adj, v, max_settled)) - len(in_adj[v]) - len(out_adj[v]) + deleted[v]
+
+    current = [priority(v) for v in range(n)]
+    heap = [(p, v) for v, p in enumerate(current)]
+    heapq.heapify(heap)
+    level = 0
+    while heap:
+        p, v = heapq.heappop(heap)
+        if rank[v] >= 0 or p != current[v]:
+            continue
+        current[v] = priority(v)
+        if heap and current[v] > heap[0][0]:
+            heapq.heappush(heap, (current[v], v))
+            continue
+
+        for u, x, w in _shortcuts(out_adj, in_adj, v, max_settled):
+            if w < out_adj[u].get(x, np.inf):
+                added += x not in out_adj[u]
+                out_adj[u][x] = w
+                in_adj[x][u] = w
+
+        # every remaining neighbour outranks v from here on
+        up[v], down[v] = out_adj[v], in_adj[v]
+        rank[v] = level
+        level += 1
+        neighbours = set(out_adj[v]) | set(in_adj[v])
+        for x in out_adj[v]:
+            del in_adj[x][v]
+        for u in in_adj[v]:
+            del out_adj[u][v]
+        out_adj[v], in_adj[v] = {}, {}
+        for x in neighbours:
+            deleted[x] += 1
+            current[x] = priority(x)
+            heapq.heappush(heap, (current[x], x))
+
+    info = {
+        "profile": profile,
+        "weights_hash": weights_hash(cg, profile),
+        "build_seconds": round(time.perf_counter() - start, 3),
+        "edges": int(matrix.nnz),
+        "shortcuts": int(added),
+    }
+    return ContractionHierarchy(rank, _csr(up, n), _csr(down, n), cg.node_ids, info)
+
+
+def weights_hash(cg, profile):
+    """Short hash of one profile's weights, so an index is never used with changed weights."""
+    return hashlib.sha1(np.ascontiguousarray(cg.weights[profile]).tobytes()).hexdigest()[:16]
+
+
+# ----------------------------
+# Save / Load
+# ----------------------------
+def ch_path(cg, profile, root=SNAPSHOT_DIR):
+    """Index directory for one profile, inside the graph's snapshot directory."""
+    base = cg.path or os.path.join(root, cg.key or cg.topology_hash())
+    return os.path.join(base, f"ch_{profile}")
+
+
+def save_ch(ch, path):
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    arrays = {"rank": ch.rank, "node_ids": ch.node_ids}
+    for name, (indptr, indices, weights) in (("up", ch.up), ("down", ch.down)):
+        arrays.update({f"{name}_indptr": indptr, f"{name}_indices": indices, f"{name}_weights": weights})
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp, name + ".npy"), np.ascontiguousarray(arr))
+    ch.info["bytes"] = int(ch.nbytes)
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(ch.info, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return path
+
+
+def load_ch(path, mmap_mode="r"):
+    """Memory-map a saved index, or None if it isn't there."""
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        info = json.load(f)
+
+    def arr(name):
+        return np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+
+    up = tuple(arr(f"up_{k}") for k in ("indptr", "indices", "weights"))
+    down = tuple(arr(f"down_{k}") for k in ("indptr", "indices", "weights"))
+    return ContractionHierarchy(arr("rank"), up, down, arr("node_ids"), info)
+
+
+def ch_for(cg, profile="free_flow", rebuild=False):
+    """The saved index for `profile` next to the graph, built and saved first if missing or stale."""
+    path = ch_path(cg, profile)
+    ch = None if rebuild else load_ch(path)
+    if ch is None or ch.info.get("weights_hash") != weights_hash(cg, profile):
+        ch = build_ch(cg, profile)
+        save_ch(ch, path)
+    return ch
+
+
+# ----------------------------
+# Checks
+# ----------------------------
+def check_against_dijkstra(cg, ch, pairs=200, seed=0):
+    """Largest |CH - Dijkstra| over random node pairs (unreachable pairs must agree too), and seconds per query."""
+    rng = np.random.default_rng(seed)
+    sources = rng.integers(0, cg.n_nodes, pairs)
+    targets = rng.integers(0, cg.n_nodes, pairs)
+    expected = dijkstra(cg.matrix(ch.info["profile"]), directed=True, indices=sources)[np.arange(pairs), targets]
+    start = time.perf_counter()
+    got = np.array([ch.query(int(s), int(t)) for s, t in zip(sources, targets)])
+    per_query = (time.perf_counter() - start) / pairs
+    finite = np.isfinite(expected)
+    if not np.array_equal(finite, np.isfinite(got)):
+        return np.inf, per_query
+    return float(np.max(np.abs(got[finite] - expected[finite]), initial=0.0)), per_query
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a contraction hierarchy next to a saved graph snapshot.")
+    parser.add_argument("key", help="snapshot key (directory name under snapshots/)")
+    parser.add_argument("--profile", default="free_flow")
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--check", type=int, default=200, help="random pairs to compare with Dijkstra")
+    args = parser.parse_args()
+
+    engine = load_snapshot(args.key)
+    if engine is None:
+        parser.error(f"no snapshot {args.key!r} under {SNAPSHOT_DIR}/")
+    ch = ch_for(engine, args.profile, rebuild=args.rebuild)
+    print(f"{args.profile}: built in {ch.info['build_seconds']:.1f}s, {ch.info['shortcuts']:,} shortcuts "
+          f"on {ch.info['edges']:,} edges, {ch.nbytes / 1e6:.1f} MB at {ch_path(engine, args.profile)}")
+    if args.check:
+        error, per_query = check_against_dijkstra(engine, ch, args.check)
+        print(f"max |CH - Dijkstra| over {args.check} pairs: {error:.3g}s, {per_query * 1e3:.3f} ms per query")
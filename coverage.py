@@ -0,0 +1,70 @@
+import numpy as np
+import geopandas as gpd
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+
+# ----------------------------
+# Coverage Field
+# ----------------------------
+def nearest_facility(cg, facility_nodes, profile="free_flow", cutoff=None, direction="to"):
+    """Time from every node to its nearest facility, in one multi-source search.
+
+    All facility nodes seed a single Dijkstra; with direction="to" it runs on
+    the reversed graph so the times are for travelling *to* the facility.
+    Returns (times, facility) per node: seconds (inf if none within cutoff)
+    and the position in `facility_nodes` of the nearest one (-1 if none).
+    The arrays are also stored on the graph as coverage_time / coverage_facility.
+    """
+    facility_nodes = list(facility_nodes)
+    sources = cg.node_index.lookup(facility_nodes).astype(np.int64)
+    matrix = cg.reverse_matrix(profile) if direction == "to" else cg.matrix(profile)
+
+    times, _, nearest = dijkstra(
+        matrix, directed=True, indices=sources, min_only=True,
+        return_predecessors=True, limit=np.inf if cutoff is None else cutoff,
+    )
+
+    # map the winning source node back to its facility (first one listed wins a shared node)
+    first = {}
+    for i, s in enumerate(sources):
+        first.setdefault(int(s), i)
+    lookup = np.full(cg.n_nodes, -1, dtype=np.int64)
+    lookup[list(first)] = list(first.values())
+    facility = np.where(nearest >= 0, lookup[np.maximum(nearest, 0)], -1)
+
+    cg.node_attrs["coverage_time"] = times
+    cg.node_attrs["coverage_facility"] = facility
+    return times, facility
+
+
+def coverage_gdf(cg, times, facility):
+    """One point per node with its time to, and index of, the nearest facility."""
+    return gpd.GeoDataFrame(
+        {"osmid": cg.node_ids, "time_s": times, "facility": facility},
+        geometry=gpd.points_from_xy(cg.x, cg.y),
+        crs="EPSG:4326",
+    )
+
+
+def coverage_grid(cg, times, cell=100, max_snap=250):
+    """Rasterise the field: each cell takes its nearest node's time.
+
+    Cells farther than `max_snap` meters from any node are NaN. Returns the
+    (rows, cols) grid in PROJECTED_CRS with row 0 at the bottom, and its
+    extent (xmin, xmax, ymin, ymax) for matplotlib's imshow(origin="lower").
+    """
+    px, py = cg.projected_xy()
+    xs = np.arange(px.min(), px.max() + cell, cell)
+    ys = np.arange(py.min(), py.max() + cell, cell)
+    gx, gy = np.meshgrid(xs + cell / 2, ys + cell / 2)
+
+    dist, nearest = cKDTree(np.column_stack([px, py])).query(
+        np.column_stack([gx.ravel(), gy.ravel()]), distance_upper_bound=max_snap
+    )
+    grid = np.full(gx.size, np.nan)
+    hit = np.isfinite(dist)
+    grid[hit] = times[nearest[hit]]
+    grid[np.isinf(grid)] = np.nan
+    extent = (xs[0], xs[-1] + cell, ys[0], ys[-1] + cell)
+    return grid.reshape(gx.shape), extent
@@ -0,0 +1,42 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+
+
+# ----------------------------
+# Network Plot
+# ----------------------------
+def edge_segments(cg):
+    """Per-edge lon/lat polylines for a LineCollection."""
+    if cg.edge_geometry is None:
+        src = cg.edge_sources()
+        return np.stack(
+            [np.column_stack([cg.x[src], cg.y[src]]), np.column_stack([cg.x[cg.indices], cg.y[cg.indices]])],
+            axis=1,
+        )
+    offsets, xy = cg.edge_geometry
+    return np.split(np.asarray(xy), np.asarray(offsets)[1:-1])
+
+
+def plot_graph(cg, bgcolor="#111111", edge_color="#999999", edge_linewidth=1,
+               figsize=(8, 8), padding=0.02):
+    """Draw a CompiledGraph's street network like ox.plot_graph(node_size=0)."""
+    fig, ax = plt.subplots(figsize=figsize, facecolor=bgcolor, frameon=False)
+    ax.set_facecolor(bgcolor)
+
+    lines = LineCollection(edge_segments(cg), colors=edge_color, linewidths=edge_linewidth, zorder=1)
+    ax.add_collection(lines)
+
+    left, right = float(np.min(cg.x)), float(np.max(cg.x))
+    bottom, top = float(np.min(cg.y)), float(np.max(cg.y))
+    pad_ns, pad_ew = (top - bottom) * padding, (right - left) * padding
+    ax.set_ylim(bottom - pad_ns, top + pad_ns)
+    ax.set_xlim(left - pad_ew, right + pad_ew)
+
+    ax.margins(0)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    ax.get_xaxis().set_visible(False)
+    ax.get_yaxis().set_visible(False)
+    ax.set_aspect(1 / np.cos(np.deg2rad((bottom + top) / 2)))
+    return fig, ax
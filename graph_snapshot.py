@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from ring_engine import CompiledGraph
+from signal_delays import update_volumes
+
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_VERSION = 1  # bump when the build pipeline changes what ends up in a snapshot
+
+
+# ----------------------------
+# Keys
+# ----------------------------
+_HASHES = {}  # (path, mtime, size) -> sha1, so both keys of a warm start read each input once
+
+
+def file_hash(path):
+    """sha1 of a file's contents, streamed in blocks and remembered until the file changes."""
+    st = os.stat(path)
+    stamp = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    if stamp not in _HASHES:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        _HASHES[stamp] = h.hexdigest()
+    return _HASHES[stamp]
+
+
+def snapshot_key(places, network_type, settings, input_files):
+    """Key a snapshot by everything that changes the finished graph."""
+    payload = {
+        "version": SNAPSHOT_VERSION,
+        "places": list(places),
+        "network_type": network_type,
+        "settings": settings,
+        "inputs": {os.path.basename(p): file_hash(p) for p in input_files},
+    }
+    blob = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.sha1(blob).hexdigest()
+
+
+# ----------------------------
+# Save / Load
+# ----------------------------
+def save_snapshot(cg, key, meta=None, root=SNAPSHOT_DIR):
+    """Write a CompiledGraph to root/key as one .npy file per array."""
+    path = os.path.join(root, key)
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    arrays = {
+        "node_ids": cg.node_ids,
+        "x": cg.x,
+        "y": cg.y,
+        "indptr": cg.indptr,
+        "indices": cg.indices,
+    }
+    arrays.update({f"weight.{k}": v for k, v in cg.weights.items()})
+    arrays.update({f"node.{k}": v for k, v in cg.node_attrs.items()})
+    arrays.update({f"edge.{k}": v for k, v in cg.edge_attrs.items()})
+    if cg.edge_geometry is not None:
+        arrays["geom_offsets"], arrays["geom_xy"] = cg.edge_geometry
+    # projected once at build time so loaders never reproject
+    arrays["px"], arrays["py"] = cg.projected_xy()
+    arrays["geom_pxy"] = cg.projected_edge_geometry()[1]
+    arrays["in_indptr"], arrays["in_order"] = cg.in_edge_order()
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp, name + ".npy"), np.ascontiguousarray(arr))
+
+    info = {
+        "key": key,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "n_nodes": int(cg.n_nodes),
+        "n_edges": int(cg.n_edges),
+        "arrays": sorted(arrays),
+        "labels": cg.labels,
+        "meta": meta or {},
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(info, f, indent=2, default=str)
+
+    # swap the finished directory in so readers never see a half-written snapshot
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    cg.key, cg.path, cg.meta = key, path, info["meta"]
+    return path
+
+
+def load_snapshot(key, root=SNAPSHOT_DIR, mmap_mode="r"):
+    """Memory-map a snapshot back into a CompiledGraph, or None if it isn't there."""
+    path = os.path.join(root, key)
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        info = json.load(f)
+
+    arrays = {
+        name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+        for name in info["arrays"]
+    }
+
+    def group(prefix):
+        return {k[len(prefix):]: v for k, v in arrays.items() if k.startswith(prefix)}
+
+    geometry = None
+    if "geom_offsets" in arrays:
+        geometry = (arrays["geom_offsets"], arrays["geom_xy"])
+    cg = CompiledGraph(
+        arrays["node_ids"], arrays["x"], arrays["y"], arrays["indptr"], arrays["indices"],
+        group("weight."),
+        node_attrs=group("node."),
+        edge_attrs=group("edge."),
+        labels=info["labels"],
+        edge_geometry=geometry,
+    )
+    cg._projected = (arrays["px"], arrays["py"])
+    if "geom_offsets" in arrays:
+        cg._projected_geometry = (arrays["geom_offsets"], arrays["geom_pxy"])
+    if "in_order" in arrays:
+        cg._in_edges = (arrays["in_indptr"], arrays["in_order"])
+    cg.key, cg.path, cg.meta = key, path, info["meta"]
+    return cg
+
+
+
+# ----------------------------
+# Incremental Updates
+# ----------------------------
+def find_snapshot(root=SNAPSHOT_DIR, **meta):
+    """Key of the newest snapshot whose meta matches every given item, or None."""
+    if not os.path.isdir(root):
+        return None
+    found = []
+    for name in os.listdir(root):
+        meta_path = os.path.join(root, name, "meta.json")
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path) as f:
+            info = json.load(f)
+        if all(info["meta"].get(k) == v for k, v in meta.items()):
+            found.append((info["created"], name))
+    return max(found)[1] if found else None
+
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:  # other filesystem, or no hard links
+        shutil.copy2(src, dst)
+
+
+def derive_snapshot(cg, key, changed, meta=None, root=SNAPSHOT_DIR):
+    """Save a patched copy of a loaded snapshot under a new key.
+
+    Only the arrays named in `changed` are written; everything else, including
+    indexes kept in subdirectories, is hard-linked from the snapshot `cg` was
+    loaded from, so the cost follows the size of the patch. Tiles carry
+    their own copy of the weights and are left to be cut again.
+    """
+    source = cg.path
+    path = os.path.join(root, key)
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    shutil.copytree(source, tmp, copy_function=_link, ignore=shutil.ignore_patterns("meta.json", "*.tmp", "tiles_*"))
+
+    arrays = {f"weight.{k}": v for k, v in cg.weights.items()}
+    arrays.update({f"node.{k}": v for k, v in cg.node_attrs.items()})
+    for name in changed:
+        target = os.path.join(tmp, name + ".npy")
+        os.remove(target)  # a fresh file, so the linked original is left alone
+        np.save(target, np.ascontiguousarray(arrays[name]))
+
+    with open(os.path.join(source, "meta.json")) as f:
+        info = json.load(f)
+    info.update(key=key, created=time.strftime("%Y-%m-%dT%H:%M:%S"), meta=meta or {})
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(info, f, indent=2, default=str)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    cg.key, cg.path, cg.meta = key, path, info["meta"]
+    return path
+
+
+def reweight_snapshot(base_key, key, volume_csv, profiles, root=SNAPSHOT_DIR):
+    """Build the snapshot for a new volume summary by patching the newest one of the same graph.
+
+    `base_key` keys everything but the volume summary (places, network,
+    lights, settings). Only edges at signals whose volumes changed are
+    re-weighted, and the meta records which nodes now lead onto changed
+    edges per profile, so RingCache can keep every ring that can't have
+    moved. Returns the patched CompiledGraph, or None when there is no
+    earlier snapshot to start from.
+    """
+    previous = find_snapshot(root, base_key=base_key)
+    if previous is None:
+        return None
+    cg = load_snapshot(previous, root, mmap_mode="c")
+    nodes, edges = update_volumes(cg, volume_csv, profiles)
+
+    changed = [f"weight.{name}" for name, e in edges.items() if len(e)]
+    if len(nodes):
+        changed += [f"node.{name}" for name in cg.node_attrs if name != "site_no"]
+    touched = {
+        name: np.unique(np.searchsorted(cg.indptr, e, side="right") - 1).tolist() for name, e in edges.items()
+    }
+    meta = {**cg.meta, "base_key": base_key, "reweighted_from": {"key": previous, "touched": touched}}
+    derive_snapshot(cg, key, changed, meta=meta, root=root)
+    return cg
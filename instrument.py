@@ -0,0 +1,163 @@
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Off unless FLOWCATION_PROFILE=1 or enable() is called; while off every hook
+# is a flag check returning a shared no-op context.
+_enabled = os.environ.get("FLOWCATION_PROFILE") == "1"
+_trace_memory = False
+_NULL = nullcontext()
+
+_frames = []                           # open stages, innermost last
+_stages = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "child_seconds": 0.0, "peak_bytes": 0})
+_counters = defaultdict(lambda: {"calls": 0, "total": 0, "max": 0})
+
+
+# ----------------------------
+# Switch
+# ----------------------------
+def enable(trace_memory=False):
+    """Start recording; with trace_memory each stage also records its tracemalloc peak (slow)."""
+    global _enabled, _trace_memory
+    _enabled, _trace_memory = True, trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    if _trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    _frames.clear()
+    _stages.clear()
+    _counters.clear()
+
+
+# ----------------------------
+# Hooks
+# ----------------------------
+class _Stage:
+    __slots__ = ("name", "start", "peak")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _trace_memory:
+            if _frames:
+                parent = _frames[-1]
+                parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.peak = 0
+        _frames.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        path = tuple(f.name for f in _frames)
+        _frames.pop()
+        stats = _stages[path]
+        stats["calls"] += 1
+        stats["seconds"] += elapsed
+        if _frames:
+            _stages[path[:-1]]["child_seconds"] += elapsed
+        if _trace_memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            stats["peak_bytes"] = max(stats["peak_bytes"], self.peak)
+            if _frames:
+                _frames[-1].peak = max(_frames[-1].peak, self.peak)
+            tracemalloc.reset_peak()
+        return False
+
+
+def stage(name):
+    """Context manager timing `name`, nested under whatever stage is open."""
+    return _Stage(name) if _enabled else _NULL
+
+
+def timed(name=None):
+    """Decorator form of stage(), named after the function by default."""
+    def decorate(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Stage(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1):
+    """Add `value` to a counter, e.g. nodes settled by one search or vertices in one hull."""
+    if not _enabled:
+        return
+    value = value.item() if hasattr(value, "item") else value  # numpy scalars -> JSON-friendly
+    c = _counters[name]
+    c["calls"] += 1
+    c["total"] += value
+    c["max"] = max(c["max"], value)
+
+
+# ----------------------------
+# Reports
+# ----------------------------
+def peak_rss_mb():
+    if resource is None:
+        return float("nan")
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024  # bytes on macOS, KB elsewhere
+
+
+def report():
+    """Stages (by nesting path), counters and process peak memory as plain dicts."""
+    stages = [
+        {
+            "path": ";".join(path),
+            "calls": s["calls"],
+            "seconds": round(s["seconds"], 6),
+            "self_seconds": round(s["seconds"] - s["child_seconds"], 6),
+            **({"peak_mb": round(s["peak_bytes"] / 1e6, 3)} if _trace_memory else {}),
+        }
+        for path, s in sorted(_stages.items(), key=lambda item: -item[1]["seconds"])
+    ]
+    counters = {
+        name: {**c, "mean": c["total"] / c["calls"] if c["calls"] else 0.0}
+        for name, c in sorted(_counters.items())
+    }
+    return {"stages": stages, "counters": counters, "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+def write_report(path):
+    with open(path, "w") as f:
+        json.dump(report(), f, indent=1)
+
+
+def write_trace(path):
+    """Collapsed stacks ("a;b;c <microseconds>") of self time, for flamegraph.pl or speedscope."""
+    with open(path, "w") as f:
+        for stack, s in _stages.items():
+            self_us = int(round((s["seconds"] - s["child_seconds"]) * 1e6))
+            if self_us > 0:
+                f.write(f"{';'.join(stack)} {self_us}\n")
@@ -0,0 +1,104 @@
+import numpy as np
+import shapely
+from contourpy import FillType, contour_generator
+from pyproj import Transformer
+from scipy.ndimage import distance_transform_edt
+
+PROJECTED_CRS = "EPSG:32755"  # UTM zone for Melbourne, in meters
+HULL_MODES = ("convex", "concave", "edges")
+
+_TO_PROJECTED = Transformer.from_crs("EPSG:4326", PROJECTED_CRS, always_xy=True)
+_TO_LONLAT = Transformer.from_crs(PROJECTED_CRS, "EPSG:4326", always_xy=True)
+
+
+def to_projected(lon, lat):
+    """Project lon/lat arrays to PROJECTED_CRS meters."""
+    return _TO_PROJECTED.transform(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+
+
+def to_lonlat(geom):
+    """Reproject a PROJECTED_CRS geometry back to lon/lat."""
+    return shapely.transform(geom, lambda xy: np.column_stack(_TO_LONLAT.transform(xy[:, 0], xy[:, 1])))
+
+
+# ----------------------------
+# Isochrone Polygons
+# ----------------------------
+def ring_polygon(cg, idx, mode="convex", buffer=150, ratio=0.3):
+    """Catchment polygon (PROJECTED_CRS) around the reached node indices `idx`.
+
+    convex  - convex hull of the nodes grown by `buffer`; the same shape as
+              buffering every node, unioning and taking the hull, without
+              building a circle per node
+    concave - concave hull (shapely alpha-shape style, tightness `ratio`)
+              grown by `buffer`, so rivers and rail corridors aren't bridged
+    edges   - every street edge with both ends reached, buffered by `buffer`
+              through a rasterised distance field (cells of buffer / 6)
+    """
+    px, py = cg.projected_xy()
+    if mode == "edges":
+        polygon = edge_buffer_polygon(*reached_edge_vertices(cg, idx), buffer, cell=buffer / 6)
+        if not polygon.is_empty:
+            return polygon
+        mode = "convex"  # no whole edge reached, fall back to the nodes themselves
+
+    points = shapely.multipoints(np.column_stack([px[idx], py[idx]]))
+    if mode == "convex":
+        return shapely.buffer(shapely.convex_hull(points), buffer)
+    if mode == "concave":
+        return shapely.buffer(shapely.concave_hull(points, ratio=ratio), buffer)
+    raise ValueError(f"unknown hull mode {mode!r}, expected one of {HULL_MODES}")
+
+
+def reached_edge_vertices(cg, idx):
+    """Projected vertices of the edges whose two endpoints are both in `idx`, plus an edge id per vertex."""
+    reached = np.zeros(cg.n_nodes, dtype=bool)
+    reached[idx] = True
+    edges = np.flatnonzero(reached[cg.edge_sources()] & reached[cg.indices])
+    offsets, pxy = cg.projected_edge_geometry()
+    starts, ends = offsets[edges], offsets[edges + 1]
+
+    # gather every edge's vertices in one go
+    counts = ends - starts
+    take = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    return pxy[take], np.repeat(np.arange(len(edges)), counts)
+
+
+def edge_buffer_polygon(xy, line_ids, buffer, cell):
+    """Polygon within `buffer` meters of the given polylines.
+
+    Buffering and unioning thousands of street lines in GEOS takes seconds,
+    so the lines are burnt into a grid instead, grown with a Euclidean
+    distance transform and traced back out at the `buffer` contour.
+    """
+    if len(xy) < 2:
+        return shapely.Polygon()
+    same = line_ids[1:] == line_ids[:-1]
+    a, b = xy[:-1][same], xy[1:][same]
+
+    # sample each segment at least twice per cell so no cell along it is skipped
+    steps = np.ceil(np.hypot(*(b - a).T) / (cell / 2)).astype(np.int64) + 1
+    t = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+    t = t / np.repeat(np.maximum(steps - 1, 1), steps)
+    samples = np.repeat(a, steps, axis=0) + (np.repeat(b - a, steps, axis=0) * t[:, None])
+
+    pad = buffer + 2 * cell
+    x0, y0 = samples.min(axis=0) - pad
+    nx, ny = ((samples.max(axis=0) + pad - (x0, y0)) / cell).astype(int) + 1
+    on_line = np.ones((ny, nx), dtype=bool)
+    ix = ((samples[:, 0] - x0) / cell).round().astype(int)
+    iy = ((samples[:, 1] - y0) / cell).round().astype(int)
+    on_line[iy, ix] = False
+    dist = distance_transform_edt(on_line) * cell
+
+    gen = contour_generator(
+        x=x0 + np.arange(nx) * cell, y=y0 + np.arange(ny) * cell, z=dist, fill_type=FillType.OuterOffset
+    )
+    points, offsets = gen.filled(-1.0, buffer)
+    polygons = [
+        shapely.Polygon(rings[0], rings[1:])
+        for rings in (np.split(p, o[1:-1]) for p, o in zip(points, offsets))
+    ]
+    if len(polygons) == 1:
+        return polygons[0]
+    return shapely.MultiPolygon(polygons) if polygons else shapely.Polygon()
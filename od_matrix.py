@@ -0,0 +1,106 @@
+import numpy as np
+import geopandas as gpd
+from scipy.sparse import coo_matrix, save_npz
+from scipy.sparse.csgraph import dijkstra
+
+from isochrones import PROJECTED_CRS
+from signal_delays import nearest_nodes
+
+MAX_BLOCK_BYTES = 256 * 2**20  # float64 search results held at once
+
+
+# ----------------------------
+# Snapping
+# ----------------------------
+def point_lonlat(points):
+    """lon/lat arrays from a GeoDataFrame/GeoSeries (polygons by projected centroid) or a (lon, lat) pair."""
+    if isinstance(points, (gpd.GeoDataFrame, gpd.GeoSeries)):
+        geoms = points.geometry if isinstance(points, gpd.GeoDataFrame) else points
+        geoms = geoms.to_crs("EPSG:4326")
+        if not (geoms.geom_type == "Point").all():
+            geoms = geoms.to_crs(PROJECTED_CRS).centroid.to_crs("EPSG:4326")
+        return geoms.x.to_numpy(), geoms.y.to_numpy()
+    lon, lat = points
+    return np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+
+
+# ----------------------------
+# Batched Searches
+# ----------------------------
+def _blocks(cg, origins, destinations, profile, cutoff, max_bytes):
+    """Yield (axis, members, block) pieces of the origins x destinations matrix.
+
+    Searches run from whichever side has fewer distinct nodes, on the
+    reversed graph when that's the destinations, a batch of sources at a
+    time sized so one batch's results fit in `max_bytes`. Origins or
+    destinations snapping to the same node share one search. axis 0 blocks
+    are whole rows for origins `members`, axis 1 blocks whole columns.
+    """
+    reverse = len(np.unique(destinations)) < len(np.unique(origins))
+    sources, targets = (destinations, origins) if reverse else (origins, destinations)
+    matrix = cg.reverse_matrix(profile) if reverse else cg.matrix(profile)
+
+    unique, inverse = np.unique(sources, return_inverse=True)
+    by_node = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[by_node], np.arange(len(unique) + 1))
+    batch = max(1, int(max_bytes // (8 * cg.n_nodes)))
+
+    for start in range(0, len(unique), batch):
+        stop = min(start + batch, len(unique))
+        dist = dijkstra(matrix, directed=True, indices=unique[start:stop], limit=np.inf if cutoff is None else cutoff)
+        members = by_node[bounds[start]:bounds[stop]]
+        block = dist[:, targets].astype(np.float32)[inverse[members] - start]
+        yield (1 if reverse else 0), members, block
+
+
+def od_matrix(cg, origins, destinations, profile="free_flow", cutoff=None, path=None, max_bytes=MAX_BLOCK_BYTES):
+    """Travel times (s, float32) from every origin to every destination, inf beyond cutoff.
+
+    Origins and destinations are point sets, snapped in bulk to their nearest
+    nodes. With `path` the matrix is written to a memory-mapped .npy file as
+    it is filled and returned as that memmap, so it never has to fit in RAM.
+    Returns (times, origin_snap_m, destination_snap_m).
+    """
+    o_idx, o_dist = nearest_nodes(cg, *point_lonlat(origins))
+    d_idx, d_dist = nearest_nodes(cg, *point_lonlat(destinations))
+    shape = (len(o_idx), len(d_idx))
+    if path is None:
+        times = np.empty(shape, dtype=np.float32)
+    else:
+        times = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+
+    for axis, members, block in _blocks(cg, o_idx, d_idx, profile, cutoff, max_bytes):
+        if axis == 0:
+            times[members] = block
+        else:
+            times[:, members] = block.T
+    if path is not None:
+        times.flush()
+    return times, o_dist, d_dist
+
+
+def od_pairs(cg, origins, destinations, profile="free_flow", cutoff=20*60, path=None, max_bytes=MAX_BLOCK_BYTES):
+    """Only the origin-destination pairs within cutoff, as a sparse CSR matrix of seconds.
+
+    Pairs beyond the cutoff are simply absent; a pair at 0 s (same node) is
+    kept as an explicit zero. With `path` it is also saved with save_npz.
+    Returns (pairs, origin_snap_m, destination_snap_m).
+    """
+    o_idx, o_dist = nearest_nodes(cg, *point_lonlat(origins))
+    d_idx, d_dist = nearest_nodes(cg, *point_lonlat(destinations))
+
+    rows, cols, data = [], [], []
+    for axis, members, block in _blocks(cg, o_idx, d_idx, profile, cutoff, max_bytes):
+        r, c = np.nonzero(np.isfinite(block))
+        rows.append(members[r] if axis == 0 else c)
+        cols.append(c if axis == 0 else members[r])
+        data.append(block[r, c])
+
+    pairs = coo_matrix(
+        (np.concatenate(data or [np.empty(0, np.float32)]),
+         (np.concatenate(rows or [np.empty(0, np.int64)]), np.concatenate(cols or [np.empty(0, np.int64)]))),
+        shape=(len(o_idx), len(d_idx)),
+    ).tocsr()
+    if path is not None:
+        save_npz(path, pairs)
+    return pairs, o_dist, d_dist
@@ -0,0 +1,374 @@
+import bz2
+import gzip
+import re
+import xml.etree.ElementTree as ET
+from array import array
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from ring_engine import CompiledGraph
+
+try:
+    import osmium
+except ImportError:  # only needed for .pbf extracts
+    osmium = None
+
+try:
+    from osmnx.routing import _IMPLICIT_MAXSPEEDS  # e.g. "RU:urban" -> 60, as add_edge_speeds reads them
+except ImportError:
+    _IMPLICIT_MAXSPEEDS = {}
+
+# Way filters matching osmnx's network_type queries: a way needs a highway tag
+# and must not match any of these (unanchored, as in Overpass) regexes.
+_COMMON = {"area": "yes", "access": "private"}
+NETWORK_FILTERS = {
+    "drive": {
+        **_COMMON,
+        "highway": "abandoned|bridleway|bus_guideway|construction|corridor|cycleway|elevator|escalator|footway|"
+                   "no|path|pedestrian|planned|platform|proposed|raceway|razed|rest_area|service|services|steps|track",
+        "motor_vehicle": "no",
+        "motorcar": "no",
+        "service": "alley|driveway|emergency_access|parking|parking_aisle|private",
+    },
+    "walk": {
+        **_COMMON,
+        "highway": "abandoned|bus_guideway|construction|cycleway|motor|no|planned|platform|proposed|raceway|"
+                   "razed|rest_area|services",
+        "foot": "no",
+        "service": "private",
+        "sidewalk": "separate",
+        "sidewalk:both": "separate",
+        "sidewalk:left": "separate",
+        "sidewalk:right": "separate",
+    },
+    "bike": {
+        **_COMMON,
+        "highway": "abandoned|bus_guideway|construction|corridor|elevator|escalator|footway|motor|no|planned|"
+                   "platform|proposed|raceway|razed|rest_area|services|steps",
+        "bicycle": "no",
+        "service": "private",
+    },
+}
+_FILTER_RE = {net: {tag: re.compile(rx) for tag, rx in rules.items()} for net, rules in NETWORK_FILTERS.items()}
+
+BIDIRECTIONAL = {"walk"}  # as osmnx: one-way tags don't apply on foot
+ONEWAY = {"yes", "true", "1", "-1", "reverse", "T", "F"}
+REVERSED = {"-1", "reverse", "T"}
+EARTH_RADIUS_M = 6_371_009
+MILES_TO_KM = 1.60934
+_MAXSPEED_RE = re.compile(r"^([0-9][\.,0-9]*?)(?:[ ]?(?:km/h|kmh|kph|mph|knots))?$")
+NODE_CHUNK = 1_000_000
+EXTRACT_VERSION = 2  # part of the snapshot key; bump when extract graphs change for the same inputs
+
+
+def way_allowed(tags, network_type):
+    """Whether a way with these tags belongs in the network_type graph."""
+    if "highway" not in tags:
+        return False
+    return not any(tag in tags and rx.search(tags[tag]) for tag, rx in _FILTER_RE[network_type].items())
+
+
+def parse_maxspeed(value):
+    """km/h from an OSM maxspeed value the way osmnx reads it, or nan.
+
+    "60", "40 mph" and per-lane "60|50" (averaged) are numbers; anything
+    else is looked up as an implicit value such as "RU:urban".
+    """
+    try:
+        speeds = [float(_MAXSPEED_RE.match(part).group(1).replace(",", ".")) for part in value.split("|")]
+    except (ValueError, AttributeError):
+        return float(_IMPLICIT_MAXSPEEDS.get(value, np.nan))
+    return float(np.mean(speeds)) * (MILES_TO_KM if "mph" in value.lower() else 1.0)
+
+
+# ----------------------------
+# Streaming Readers
+# ----------------------------
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _xml_elements(path):
+    """Top-level nodes, ways and relations, parsed incrementally. Each one is
+    dropped from the root once handled, so memory stays flat with file size."""
+    with _open(path) as f:
+        events = ET.iterparse(f, events=("start", "end"))
+        _, root = next(events)
+        for event, elem in events:
+            if event == "end" and elem.tag in ("node", "way", "relation"):
+                yield elem
+                root.clear()
+
+
+def _xml_ways(path):
+    """(refs, tags) for every way."""
+    for elem in _xml_elements(path):
+        if elem.tag == "way":
+            refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+            tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+            yield refs, tags
+
+
+def _xml_nodes(path):
+    for elem in _xml_elements(path):
+        if elem.tag == "node":
+            yield int(elem.get("id")), float(elem.get("lon")), float(elem.get("lat"))
+
+
+def _pbf_ways(path):
+    for way in osmium.FileProcessor(path, osmium.osm.WAY):
+        yield [n.ref for n in way.nodes], dict(way.tags)
+
+
+def _pbf_nodes(path):
+    for node in osmium.FileProcessor(path, osmium.osm.NODE):
+        if node.location.valid():
+            yield node.id, node.location.lon, node.location.lat
+
+
+def _readers(path):
+    if path.endswith(".pbf"):
+        if osmium is None:
+            raise ImportError("reading .osm.pbf extracts needs pyosmium (pip install osmium)")
+        return _pbf_ways, _pbf_nodes
+    return _xml_ways, _xml_nodes
+
+
+# ----------------------------
+# Extract -> CompiledGraph
+# ----------------------------
+def graph_from_extract(path, network_type="drive", hwy_speeds=None, fallback=40, speed_kph=None):
+    """Build a CompiledGraph straight from a local .osm(.gz/.bz2) or .osm.pbf extract.
+
+    Two streaming passes: the first keeps only the node lists of ways passing
+    the network_type filter, the second keeps only the coordinates of nodes
+    those ways use, checked a chunk at a time. Ways are split at junctions
+    and way ends like osmnx's simplified graph, one-way rules follow osmnx,
+    and only the largest weakly connected component is kept.
+
+    Speeds follow add_edge_speeds on the simplified graph, one speed per
+    merged edge: the mean of the distinct maxspeed values along it, else
+    hwy_speeds for its highway type, else the mean maxspeed of the edges of
+    that type, else `fallback`. A fixed `speed_kph` (walk/bike) overrides
+    them all. free_flow is length / speed.
+    """
+    read_ways, read_nodes = _readers(path)
+
+    # pass 1: ways
+    refs, offsets = array("q"), array("q", [0])
+    highway, oneway, maxspeed = [], array("b"), array("q")
+    maxspeed_codes = {}  # raw maxspeed string -> code; osmnx merges distinct strings
+    bidirectional = network_type in BIDIRECTIONAL
+    for way_refs, tags in read_ways(path):
+        if len(way_refs) < 2 or not way_allowed(tags, network_type):
+            continue
+        refs.extend(way_refs)
+        offsets.append(len(refs))
+        highway.append(tags["highway"])
+        one = not bidirectional and (tags.get("oneway") in ONEWAY or tags.get("junction") == "roundabout")
+        oneway.append(0 if not one else (-1 if tags.get("oneway") in REVERSED else 1))
+        maxspeed.append(maxspeed_codes.setdefault(tags["maxspeed"], len(maxspeed_codes)) if "maxspeed" in tags else -1)
+
+    refs = np.frombuffer(refs, dtype=np.int64)
+    offsets = np.frombuffer(offsets, dtype=np.int64)
+    needed = np.unique(refs)
+
+    # pass 2: coordinates of the nodes those ways use
+    ids, lons, lats = [], [], []
+    chunk = (array("q"), array("d"), array("d"))
+    for node_id, lon, lat in read_nodes(path):
+        chunk[0].append(node_id)
+        chunk[1].append(lon)
+        chunk[2].append(lat)
+        if len(chunk[0]) >= NODE_CHUNK:
+            _keep_needed(chunk, needed, ids, lons, lats)
+            chunk = (array("q"), array("d"), array("d"))
+    _keep_needed(chunk, needed, ids, lons, lats)
+    ids, lons, lats = np.concatenate(ids), np.concatenate(lons), np.concatenate(lats)
+    order = np.argsort(ids)
+    ids, lons, lats = ids[order], lons[order], lats[order]
+
+    maxspeed_values = np.array([parse_maxspeed(v) for v in maxspeed_codes], dtype=np.float64)
+    return _build(refs, offsets, np.array(highway), np.frombuffer(oneway, dtype=np.int8),
+                  np.frombuffer(maxspeed, dtype=np.int64), maxspeed_values, ids, lons, lats,
+                  hwy_speeds or {}, fallback, speed_kph)
+
+
+def _keep_needed(chunk, needed, ids, lons, lats):
+    chunk_ids = np.frombuffer(chunk[0], dtype=np.int64)
+    keep = np.isin(chunk_ids, needed)
+    ids.append(chunk_ids[keep])
+    lons.append(np.frombuffer(chunk[1], dtype=np.float64)[keep])
+    lats.append(np.frombuffer(chunk[2], dtype=np.float64)[keep])
+
+
+def _build(refs, offsets, highway, oneway, maxspeed, maxspeed_values, ids, lons, lats, hwy_speeds, fallback,
+           speed_kph):
+    n_ways = len(offsets) - 1
+    way = np.repeat(np.arange(n_ways), np.diff(offsets))
+
+    # nodes missing from the extract (ways cut at its edge) split their way into pieces
+    pos = np.searchsorted(ids, refs)
+    found = (pos < len(ids)) & (ids[np.minimum(pos, len(ids) - 1)] == refs)
+    new_piece = np.ones(len(refs), dtype=bool)
+    new_piece[1:] = (way[1:] != way[:-1]) | ~found[:-1]
+    piece = np.cumsum(new_piece) - 1
+    pos, way, piece = pos[found], way[found], piece[found]
+    starts = np.ones(len(pos), dtype=bool)
+    starts[1:] = piece[1:] != piece[:-1]
+    ends = np.ones(len(pos), dtype=bool)
+    ends[:-1] = piece[1:] != piece[:-1]
+
+    # split at junctions (used more than once) and at the ends of every piece
+    junction = (np.bincount(pos, minlength=len(ids)) > 1)[pos] | starts | ends
+    cut = np.flatnonzero(junction)
+    same = piece[cut[1:]] == piece[cut[:-1]]
+    seg_a, seg_b = cut[:-1][same], cut[1:][same]   # first and last ref of each segment
+    seg_way = way[seg_a]
+
+    # great-circle length of every consecutive ref pair, summed along each segment
+    lam, phi = np.deg2rad(lons[pos]), np.deg2rad(lats[pos])
+    h = np.sin(np.diff(phi) / 2) ** 2 + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(np.diff(lam) / 2) ** 2
+    cum = np.concatenate([[0.0], np.cumsum(2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(h)))])
+    seg_len = cum[seg_b] - cum[seg_a]
+
+    # directed edges: forward, reverse, or both
+    direction = oneway[seg_way]
+    fwd = np.flatnonzero(direction >= 0)
+    rev = np.flatnonzero(direction <= 0)
+    e_seg = np.concatenate([fwd, rev])
+    e_reversed = np.concatenate([np.zeros(len(fwd), bool), np.ones(len(rev), bool)])
+    e_u = np.where(e_reversed, pos[seg_b[e_seg]], pos[seg_a[e_seg]])
+    e_v = np.where(e_reversed, pos[seg_a[e_seg]], pos[seg_b[e_seg]])
+    # the OSM nodes right next to each end, which osmnx counts as the end's neighbours
+    e_u_next = np.where(e_reversed, pos[seg_b[e_seg] - 1], pos[seg_a[e_seg] + 1])
+    e_v_prev = np.where(e_reversed, pos[seg_a[e_seg] + 1], pos[seg_b[e_seg] - 1])
+
+    # ragged geometry of every directed edge, walking reversed ones backwards
+    a, b = seg_a[e_seg], seg_b[e_seg]
+    counts = b - a + 1
+    step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    take = np.where(np.repeat(e_reversed, counts), np.repeat(b, counts) - step, np.repeat(a, counts) + step)
+    e_geom = np.split(pos[take], np.cumsum(counts)[:-1])
+
+    # keep the graph's nodes, then only its largest weakly connected component
+    nodes = np.unique(np.concatenate([e_u, e_v]))
+    u, v = np.searchsorted(nodes, e_u), np.searchsorted(nodes, e_v)
+    adjacency = csr_matrix((np.ones(len(u)), (u, v)), shape=(len(nodes), len(nodes)))
+    _, labels = connected_components(adjacency, directed=True, connection="weak")
+    keep = np.flatnonzero(labels[u] == np.argmax(np.bincount(labels)))
+
+    # merge runs through pass-through nodes into single edges, as simplify_graph does
+    chains = _chains(u[keep], v[keep], len(nodes), e_u_next[keep], e_v_prev[keep], nodes)
+    first = keep[[c[0] for c in chains]]
+    last = keep[[c[-1] for c in chains]]
+    flat = keep[np.concatenate(chains)]
+    bounds = np.cumsum([0] + [len(c) for c in chains])[:-1]
+    e_len = np.add.reduceat(seg_len[e_seg[flat]], bounds)
+    e_geom = [np.concatenate([e_geom[keep[c[0]]]] + [e_geom[keep[i]][1:] for i in c[1:]]) for c in chains]
+
+    used = np.unique(np.concatenate([u[first], v[last]]))
+    src, dst = np.searchsorted(used, u[first]), np.searchsorted(used, v[last])
+    nodes = nodes[used]
+
+    # CSR order
+    order = np.argsort(src, kind="stable")
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=len(nodes)), out=indptr[1:])
+    e_geom = [e_geom[i] for i in order]
+    geom_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum([len(g) for g in e_geom], out=geom_offsets[1:])
+    geom = np.concatenate(e_geom)
+    xy = np.column_stack([lons[geom], lats[geom]])
+
+    # one speed per merged edge, as add_edge_speeds + add_edge_travel_times
+    highway_labels, highway_codes = np.unique(highway, return_inverse=True)
+    e_highway = highway_codes[seg_way[e_seg[first]]]
+    if speed_kph is not None:
+        e_speed = np.full(len(chains), float(speed_kph))
+    else:
+        chain = np.repeat(np.arange(len(chains)), [len(c) for c in chains])
+        e_speed = _edge_maxspeed(chain, maxspeed[seg_way[e_seg[flat]]], maxspeed_values, len(chains))
+        e_speed = _impute_speeds(e_speed, e_highway, highway_labels, hwy_speeds, fallback)
+    e_time = (e_len / 1000) / (e_speed / (60 * 60))
+
+    return CompiledGraph(
+        ids[nodes], lons[nodes], lats[nodes], indptr, dst[order],
+        {"free_flow": e_time[order]},
+        edge_attrs={"length": e_len[order], "highway": e_highway[order].astype(np.int16)},
+        labels={"highway": highway_labels.tolist()},
+        edge_geometry=(geom_offsets, xy),
+    )
+
+
+def _edge_maxspeed(chain, codes, values, n):
+    """Per merged edge, the mean of the distinct maxspeed values its segments carry (nan if none).
+
+    As simplify_graph: distinct raw strings are kept, unparseable ones dropped.
+    """
+    have = codes >= 0
+    pairs = np.unique(np.column_stack([chain[have], codes[have]]), axis=0).reshape(-1, 2)
+    speed = values[pairs[:, 1]]
+    ok = ~np.isnan(speed)
+    total = np.bincount(pairs[ok, 0], weights=speed[ok], minlength=n)
+    count = np.bincount(pairs[ok, 0], minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def _impute_speeds(speed, highway, labels, hwy_speeds, fallback):
+    """Fill missing edge speeds per highway type, in add_edge_speeds' order of preference."""
+    by_type = {k: float(v) for k, v in hwy_speeds.items() if v is not None and not np.isnan(v)}
+    for code, label in enumerate(labels):
+        if label not in by_type:
+            observed = speed[(highway == code) & ~np.isnan(speed)]
+            by_type[label] = float(observed.mean()) if len(observed) else np.nan
+    # types with no value anywhere get `fallback`, or else the mean over every type that has one
+    known = [v for v in by_type.values() if not np.isnan(v)]
+    default = float(fallback) if fallback is not None and not np.isnan(fallback) else (
+        float(np.mean(known)) if known else np.nan)
+    imputed = np.array([by_type[label] for label in labels], dtype=np.float64)
+    imputed = np.where(np.isnan(imputed), default, imputed)
+    return np.where(np.isnan(speed), imputed[highway], speed)
+
+
+def _chains(u, v, n, u_next, v_prev, nodes):
+    """Edge runs between endpoints, with osmnx's rule for which nodes are endpoints.
+
+    A node is passed through (not an endpoint) when it has no self-loop,
+    both in- and out-edges, exactly two distinct neighbours and degree 2 or
+    4, i.e. the middle of a one-way or two-way street. osmnx applies the
+    rule before any merging, so neighbours are the adjacent OSM nodes
+    (`u_next`, `v_prev`, as indices into the extract's node ids), not the
+    far ends of the segments.
+    """
+    out_degree, in_degree = np.bincount(u, minlength=n), np.bincount(v, minlength=n)
+    ends = np.concatenate([u, v])
+    pairs = np.unique(np.column_stack([ends, np.concatenate([u_next, v_prev])]), axis=0)
+    neighbours = np.bincount(pairs[:, 0], minlength=n)
+    self_loop = np.zeros(n, dtype=bool)
+    self_loop[pairs[nodes[pairs[:, 0]] == pairs[:, 1], 0]] = True
+    degree = in_degree + out_degree
+    through = ~self_loop & (in_degree > 0) & (out_degree > 0) & (neighbours == 2) & ((degree == 2) | (degree == 4))
+
+    order = np.argsort(u, kind="stable")
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(out_degree, out=ptr[1:])
+    u_list, v_list, order_list, ptr_list, through_list = u.tolist(), v.tolist(), order.tolist(), ptr.tolist(), through.tolist()
+
+    chains = []
+    for e in np.flatnonzero(~through[u]).tolist():
+        chain, prev, node = [e], u_list[e], v_list[e]
+        while through_list[node]:
+            out = order_list[ptr_list[node]:ptr_list[node + 1]]
+            nxt = out[0] if len(out) == 1 or v_list[out[0]] != prev else out[1]
+            chain.append(nxt)
+            prev, node = node, v_list[nxt]
+        chains.append(chain)
+    return chains
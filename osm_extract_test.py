@@ -0,0 +1,111 @@
+import os
+import tempfile
+import tracemalloc
+
+import numpy as np
+import osmnx as ox
+
+from osm_extract import _xml_nodes, _xml_ways, graph_from_extract
+from ring_engine import compile_graph
+
+SPEEDS = {"residential": 40}
+
+# 5 x 5 lattice; every row is two ways meeting mid-row (merged into one edge by simplification),
+# the outer columns tie the rows together and run one node past them, so every corner is a junction
+ROWS = [
+    ("residential", None, None),
+    ("unclassified", "50", None),   # only one half has a maxspeed: it applies to the whole merged edge
+    ("unclassified", None, None),   # imputed from the other unclassified edges
+    ("unclassified", "70", "40"),   # two values along one merged edge: their mean
+    ("living_street", None, None),  # no speed for the type anywhere: fallback
+]
+COLUMNS = [(0, {"highway": "primary", "maxspeed": "60|40"}), (4, {"highway": "secondary", "maxspeed": "30 mph", "oneway": "yes"})]
+
+
+def _node(r, c):
+    return 1100 + r * 10 + c
+
+
+def write_extract(path):
+    ways = []
+    for r, (highway, left, right) in enumerate(ROWS):
+        for speed, cols in ((left, range(0, 3)), (right, range(2, 5))):
+            tags = {"highway": highway, **({"maxspeed": speed} if speed else {})}
+            ways.append(([_node(r, c) for c in cols], tags))
+    for c, tags in COLUMNS:
+        ways.append(([_node(r, c) for r in range(-1, 6)], tags))
+
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+        for r in range(-1, 6):
+            for c in range(5):
+                f.write(f' <node id="{_node(r, c)}" lat="{-37.80 + r * 0.001}" lon="{144.96 + c * 0.0012}"/>\n')
+        for i, (refs, tags) in enumerate(ways):
+            f.write(f' <way id="{i + 1}">\n')
+            f.writelines(f'  <nd ref="{n}"/>\n' for n in refs)
+            f.writelines(f'  <tag k="{k}" v="{v}"/>\n' for k, v in tags.items())
+            f.write(" </way>\n")
+        f.write("</osm>\n")
+
+
+def _edges(cg):
+    src = np.repeat(cg.node_ids, np.diff(cg.indptr))
+    return {
+        (int(u), int(v)): (float(length), float(t))
+        for u, v, length, t in zip(src, cg.node_ids[cg.indices], cg.edge_attrs["length"], cg.weights["free_flow"])
+    }
+
+
+def check_parity(fallback):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "lattice.osm")
+        write_extract(path)
+        extract = _edges(graph_from_extract(path, "drive", hwy_speeds=SPEEDS, fallback=fallback))
+        G = ox.graph_from_xml(path, bidirectional=False, simplify=True, retain_all=False)
+    ox.routing.add_edge_speeds(G, hwy_speeds=SPEEDS, fallback=fallback)
+    ox.routing.add_edge_travel_times(G)
+    reference = _edges(compile_graph(G))
+
+    assert extract.keys() == reference.keys()
+    for edge, (length, travel_time) in reference.items():
+        assert np.isclose(extract[edge][0], length, rtol=1e-9), edge
+        assert np.isclose(extract[edge][1], travel_time, rtol=1e-9), (edge, extract[edge][1], travel_time)
+
+
+def test_travel_times_match_osmnx():
+    check_parity(fallback=40)
+
+
+def test_travel_times_match_osmnx_without_fallback():
+    check_parity(fallback=None)
+
+
+def _peak_bytes(path, reader):
+    tracemalloc.start()
+    for _ in reader(path):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def test_xml_readers_stay_flat():
+    """Streaming 10x the nodes must not need ~10x the memory (finished elements are let go)."""
+    with tempfile.TemporaryDirectory() as directory:
+        peaks = {}
+        for n in (10_000, 100_000):
+            path = os.path.join(directory, f"{n}.osm")
+            with open(path, "w") as f:
+                f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+                f.writelines(f' <node id="{i + 1}" lat="-37.8" lon="144.96"><tag k="a" v="b"/></node>\n' for i in range(n))
+                f.write(' <way id="1">\n  <nd ref="1"/>\n  <tag k="highway" v="residential"/>\n </way>\n</osm>\n')
+            peaks[n] = [_peak_bytes(path, reader) for reader in (_xml_nodes, _xml_ways)]
+    for small, large in zip(peaks[10_000], peaks[100_000]):
+        assert large < 2 * small, peaks
+
+
+if __name__ == "__main__":
+    test_travel_times_match_osmnx()
+    test_travel_times_match_osmnx_without_fallback()
+    test_xml_readers_stay_flat()
+    print("extract lengths and travel times match osmnx")
@@ -0,0 +1,193 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely import wkb
+
+from graph_snapshot import load_snapshot, save_snapshot
+from od_matrix import point_lonlat
+from ring_engine import generate_bands, generate_ring
+from signal_delays import nearest_nodes
+from tiles import TiledGraph
+
+_graph = None  # per-worker CompiledGraph, memory-mapped from the snapshot
+
+
+# ----------------------------
+# Worker Side
+# ----------------------------
+def _attach(key, root, tiles_path=None):
+    """Pool initializer: map the snapshot once per worker instead of pickling the graph."""
+    global _graph
+    _graph = load_snapshot(key, root=root)
+    if tiles_path is not None:
+        _graph.tiles = TiledGraph(tiles_path)
+
+
+def _ring(cg, node, cutoff, profile, mode):
+    if cg.tiles is not None:
+        return cg.tiles.ring(node, cutoff=cutoff, profile=profile, mode=mode)
+    return generate_ring(cg, node, cutoff=cutoff, profile=profile, mode=mode)
+
+
+def _bands(cg, node, cutoffs, profile, mode):
+    if cg.tiles is not None:
+        return cg.tiles.bands(node, cutoffs=cutoffs, profile=profile, mode=mode)
+    return generate_bands(cg, node, cutoffs=cutoffs, profile=profile, mode=mode)
+
+
+def _ring_task(args):
+    node, cutoff, profile, mode = args
+    reachable_nodes, hull_gdf = _ring(_graph, node, cutoff, profile, mode)
+    hull = None if hull_gdf.empty else wkb.dumps(hull_gdf.geometry.iloc[0])
+    return np.asarray(reachable_nodes, dtype=np.int64), hull
+
+
+def _bands_task(args):
+    node, cutoffs, profile, mode = args
+    reachable_nodes, bands_gdf = _bands(_graph, node, cutoffs, profile, mode)
+    return np.asarray(reachable_nodes, dtype=np.int64), [wkb.dumps(g) for g in bands_gdf.geometry]
+
+
+def _unpack(result):
+    reachable_nodes, hull = result
+    if hull is None:
+        return reachable_nodes.tolist(), gpd.GeoDataFrame(geometry=[])
+    return reachable_nodes.tolist(), gpd.GeoDataFrame(geometry=[wkb.loads(hull)], crs="EPSG:4326")
+
+
+def _unpack_bands(result, cutoffs):
+    reachable_nodes, bands = result
+    if not bands:
+        return reachable_nodes.tolist(), gpd.GeoDataFrame({"cutoff": []}, geometry=[])
+    geoms = [wkb.loads(b) for b in bands]
+    return reachable_nodes.tolist(), gpd.GeoDataFrame({"cutoff": sorted(cutoffs)}, geometry=geoms, crs="EPSG:4326")
+
+
+# ----------------------------
+# Facilities
+# ----------------------------
+def prepare_facilities(cg, features):
+    """Snap every facility in one KD-tree query and group the ones that land on the same node.
+
+    Polygons count by their centroid in the projected CRS. Returns
+    (facilities, nodes): `nodes` are the distinct OSM ids to search from,
+    and `facilities` has one row per feature with its lon, lat, snapped
+    node, snap_m (meters) and source, its position in `nodes`.
+    """
+    lon, lat = point_lonlat(features)
+    idx, dist = nearest_nodes(cg, lon, lat)
+    unique, source = np.unique(idx, return_inverse=True)
+    facilities = pd.DataFrame(
+        {"lon": lon, "lat": lat, "node": cg.node_ids[idx], "snap_m": dist, "source": source.ravel()},
+        index=features.index,
+    )
+    return facilities, cg.node_ids[unique].tolist()
+
+
+def fan_out(rings, facilities):
+    """Per-facility results from the per-node ones, in the order of `facilities`."""
+    return [rings[i] for i in facilities["source"]]
+
+
+def facility_report(facilities):
+    """Snap distances and how many searches grouping by node saved."""
+    snap = facilities["snap_m"].to_numpy()
+    sources = facilities["source"].nunique()
+    return {
+        "facilities": len(facilities),
+        "sources": sources,
+        "dedup_ratio": len(facilities) / sources if sources else 1.0,
+        "snap_median_m": float(np.median(snap)) if len(snap) else 0.0,
+        "snap_p90_m": float(np.percentile(snap, 90)) if len(snap) else 0.0,
+        "snap_max_m": float(snap.max(initial=0.0)),
+    }
+
+
+# ----------------------------
+# Parallel Rings
+# ----------------------------
+def compute_rings(cg, nodes, cutoff=20*60, profile="free_flow", mode="convex", workers=None, cache=None):
+    """generate_ring for every node, spread over a process pool.
+
+    Results come back in the order of `nodes`. workers=1 runs in-process;
+    otherwise workers attach to the graph's memory-mapped snapshot, saving
+    a temporary one first if the graph was never snapshotted. With a
+    RingCache, only the misses are computed and they are stored back.
+    """
+    nodes = list(nodes)
+    rings = [None] * len(nodes)
+    if cache is not None:
+        rings = [cache.get(cg, node, cutoff, profile, mode) for node in nodes]
+    todo = [i for i, ring in enumerate(rings) if ring is None]
+
+    computed = _compute(cg, [nodes[i] for i in todo], cutoff, profile, mode, workers)
+    for i, ring in zip(todo, computed):
+        rings[i] = ring
+        if cache is not None:
+            cache.put(cg, nodes[i], cutoff, profile, ring, mode)
+    return rings
+
+
+def compute_bands(cg, nodes, cutoffs=(5*60, 10*60, 15*60, 20*60), profile="free_flow", mode="convex", workers=None):
+    """generate_bands for every node, with the same pool and ordering as compute_rings."""
+    nodes = list(nodes)
+    order = _cell_order(cg, nodes)
+    if (workers or os.cpu_count() or 1) == 1 or len(nodes) < 2:
+        done = [_bands(cg, nodes[i], cutoffs, profile, mode) for i in order]
+    else:
+        tasks = [(nodes[i], tuple(cutoffs), profile, mode) for i in order]
+        done = [_unpack_bands(r, cutoffs) for r in _run_pool(cg, _bands_task, tasks, workers)]
+    return _restore(done, order)
+
+
+def _compute(cg, nodes, cutoff, profile, mode, workers):
+    order = _cell_order(cg, nodes)
+    if (workers or os.cpu_count() or 1) == 1 or len(nodes) < 2:
+        done = [_ring(cg, nodes[i], cutoff, profile, mode) for i in order]
+    else:
+        tasks = [(nodes[i], cutoff, profile, mode) for i in order]
+        done = [_unpack(r) for r in _run_pool(cg, _ring_task, tasks, workers)]
+    return _restore(done, order)
+
+
+def _cell_order(cg, nodes):
+    """Positions of `nodes` grouped by tile cell, so nodes of one cell share a subgraph; as given without tiles."""
+    if cg.tiles is None or len(nodes) < 2:
+        return np.arange(len(nodes))
+    cells = [int(cg.tiles.node_cell[cg.tiles.index_of(node)]) for node in nodes]
+    return np.argsort(cells, kind="stable")
+
+
+def _restore(results, order):
+    """Results computed in `order` back in the original order."""
+    restored = [None] * len(results)
+    for i, result in zip(order, results):
+        restored[i] = result
+    return restored
+
+
+def _run_pool(cg, task, tasks, workers):
+    """Map `task` over a process pool whose workers memory-map cg's snapshot."""
+    workers = workers or os.cpu_count() or 1
+    tmp = None
+    if cg.path is None:
+        tmp = tempfile.mkdtemp(prefix="rings_")
+        # keep the caller's meta (e.g. places for the basemap); save_snapshot sets cg.meta to what it saved
+        save_snapshot(cg, "graph", root=tmp, meta=cg.meta)
+    try:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_attach,
+            initargs=(cg.key, os.path.dirname(cg.path), cg.tiles.path if cg.tiles is not None else None),
+        ) as pool:
+            return list(pool.map(task, tasks, chunksize=chunksize))
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+            cg.key = cg.path = None
@@ -0,0 +1,102 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import matplotlib
+matplotlib.use("Agg")  # maps are written to disk, never shown
+import numpy as np
+import shapely
+from matplotlib.collections import PathCollection
+from matplotlib.colors import to_rgba_array
+from matplotlib.path import Path
+
+import instrument
+
+
+# ----------------------------
+# Stage Timing
+# ----------------------------
+class StageTimer:
+    """Wall time per named stage, summed over repeats (e.g. one "save" per exported map).
+
+    Stages are also passed on to the instrument module when it is enabled.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.info = {}  # other numbers the run reports, e.g. facility snapping
+
+    @contextmanager
+    def __call__(self, stage):
+        start = time.perf_counter()
+        try:
+            with instrument.stage(stage):
+                yield
+        finally:
+            self.seconds[stage] += time.perf_counter() - start
+            self.calls[stage] += 1
+
+    def report(self):
+        total = sum(self.seconds.values())
+        lines = [f"{stage:<10} {s:8.3f}s  x{self.calls[stage]}" for stage, s in self.seconds.items()]
+        return "\n".join(lines + [f"{'total':<10} {total:8.3f}s"])
+
+
+# ----------------------------
+# Collections
+# ----------------------------
+def polygon_paths(geoms):
+    """One compound Path (exterior + holes) per polygon part, and the input index each part came from."""
+    parts, owner = shapely.get_parts(np.asarray(geoms, dtype=object), return_index=True)
+    keep = shapely.get_type_id(parts) == 3  # polygons only
+    parts, owner = parts[keep], owner[keep]
+    if len(parts) == 0:
+        return [], owner
+
+    _, coords, (ring_offsets, part_offsets) = shapely.to_ragged_array(parts)
+    codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+    codes[ring_offsets[:-1]] = Path.MOVETO
+    codes[ring_offsets[1:] - 1] = Path.CLOSEPOLY
+
+    split = ring_offsets[part_offsets[1:-1]]
+    paths = [Path(v, c) for v, c in zip(np.split(coords, split), np.split(codes, split))]
+    return paths, owner
+
+
+def add_polygons(ax, geoms, facecolor="blue", edgecolor="none", alpha=None, linewidth=0, zorder=1):
+    """Draw any number of (Multi)Polygons as a single PathCollection.
+
+    `facecolor` is one colour or one per geometry.
+    """
+    paths, owner = polygon_paths(geoms)
+    facecolors = to_rgba_array(facecolor)
+    if len(facecolors) > 1:
+        facecolors = facecolors[owner]
+    collection = PathCollection(
+        paths, facecolors=facecolors, edgecolors=edgecolor, linewidths=linewidth, alpha=alpha, zorder=zorder
+    )
+    ax.add_collection(collection, autolim=False)
+    return collection
+
+
+def draw_rings(ax, rings, band_colors=None):
+    """All hulls (or all nested bands) of a batch of rings as one collection."""
+    if band_colors is None:
+        hulls = [
+            hull_gdf.geometry.iloc[0] for _, hull_gdf in rings
+            if not hull_gdf.empty and hull_gdf.geometry.iloc[0].geom_type in ("Polygon", "MultiPolygon")
+        ]
+        return add_polygons(
+            ax, hulls, facecolor="blue", edgecolor="darkblue", alpha=0.10, linewidth=1.5, zorder=3
+        )
+
+    # graded bands, outermost first so the inner ones sit on top
+    geoms, colors = [], []
+    for i in reversed(range(len(band_colors))):
+        for _, bands_gdf in rings:
+            if i < len(bands_gdf):
+                geoms.append(bands_gdf.geometry.iloc[i])
+                colors.append(band_colors[i])
+    return add_polygons(ax, geoms, facecolor=colors if colors else "none", alpha=0.15, zorder=3)
+
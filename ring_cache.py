@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+import geopandas as gpd
+from shapely import wkb
+
+RING_CACHE_DIR = "cache_rings"
+
+
+# ----------------------------
+# Ring Cache
+# ----------------------------
+class RingCache:
+    """Two-tier cache of generate_ring results.
+
+    An in-memory LRU sits in front of an on-disk store laid out as
+    root/<graph key>/<profile>/<mode>_<cutoff>/<node>.npz, holding the reached
+    node indices (int32, nearest first) and the hull as WKB. The graph key is
+    the snapshot key, which already changes with the volume data, and rings
+    of superseded graphs for the same places and network type are evicted
+    the first time the new graph is seen. When the new graph was patched
+    from the old one (graph_snapshot.reweight_snapshot), rings whose reached
+    set holds no node leading onto a re-weighted edge are moved over first;
+    only the rest are dropped and searched again on their next request.
+    """
+
+    def __init__(self, root=RING_CACHE_DIR, max_items=512):
+        self.root = root
+        self.max_items = max_items
+        self._memory = OrderedDict()
+        self._checked = set()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evicted_graphs = 0
+        self.carried_over = 0
+        self.invalidated = 0
+
+    # --- keys ---
+    def graph_key(self, cg):
+        # a graph that was never snapshotted is keyed by its weights too, so re-weighting it misses
+        return cg.key or f"{cg.topology_hash()}_{cg.weights_hash()}"
+
+    def _entry_path(self, graph_key, node, cutoff, profile, mode):
+        return os.path.join(self.root, graph_key, profile, f"{mode}_{cutoff:g}", f"{node}.npz")
+
+    # --- lookups ---
+    def get(self, cg, node, cutoff, profile, mode="convex"):
+        """Cached (reachable_nodes, hull_gdf), or None on a miss."""
+        graph_key = self.graph_key(cg)
+        self._evict_stale(cg, graph_key)
+        key = (graph_key, profile, mode, float(cutoff), int(node))
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits_memory += 1
+            return self._memory[key]
+
+        path = self._entry_path(graph_key, node, cutoff, profile, mode)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        with np.load(path) as data:
+            ring = _unpack(cg, data["nodes"], data["hull"].tobytes())
+        self.hits_disk += 1
+        self._remember(key, ring)
+        return ring
+
+    def put(self, cg, node, cutoff, profile, ring, mode="convex"):
+        graph_key = self.graph_key(cg)
+        self._evict_stale(cg, graph_key)
+        key = (graph_key, profile, mode, float(cutoff), int(node))
+        self._remember(key, ring)
+
+        reachable_nodes, hull_gdf = ring
+        idx = cg.node_index.lookup(reachable_nodes)
+        hull = b"" if hull_gdf.empty else wkb.dumps(hull_gdf.geometry.iloc[0])
+        path = self._entry_path(graph_key, node, cutoff, profile, mode)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, nodes=idx, hull=np.frombuffer(hull, dtype=np.uint8))
+        os.replace(tmp, path)
+
+    def _remember(self, key, ring):
+        self._memory[key] = ring
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    # --- staleness ---
+    def _evict_stale(self, cg, graph_key):
+        """Drop on-disk rings of older graphs built for the same places and network."""
+        if graph_key in self._checked:
+            return
+        self._checked.add(graph_key)
+        if not cg.meta:
+            return  # never snapshotted, so there's no lineage to compare against
+        family = _family(cg)
+        os.makedirs(os.path.join(self.root, graph_key), exist_ok=True)
+        with open(os.path.join(self.root, graph_key, "graph.json"), "w") as f:
+            json.dump({"family": family, "meta": cg.meta}, f, default=str)
+        if "reweighted_from" in cg.meta:
+            self._carry_over(cg, cg.meta["reweighted_from"])
+
+        for name in os.listdir(self.root):
+            info_path = os.path.join(self.root, name, "graph.json")
+            if name == graph_key or not os.path.exists(info_path):
+                continue
+            with open(info_path) as f:
+                if json.load(f).get("family") != family:
+                    continue
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            self.evicted_graphs += 1
+
+    def _carry_over(self, cg, source):
+        """Move the rings of the graph `cg` was patched from that no re-weighted edge can reach."""
+        old_root = os.path.join(self.root, source["key"])
+        if not os.path.isdir(old_root):
+            return
+        for profile in os.listdir(old_root):
+            profile_dir = os.path.join(old_root, profile)
+            if not os.path.isdir(profile_dir):
+                continue
+            # a ring can only change if the search relaxed an edge whose weight moved
+            touched = np.asarray(source["touched"].get(profile, []), dtype=np.int64)
+            for ring_dir in os.listdir(profile_dir):
+                target = os.path.join(self.root, self.graph_key(cg), profile, ring_dir)
+                os.makedirs(target, exist_ok=True)
+                for name in os.listdir(os.path.join(profile_dir, ring_dir)):
+                    path = os.path.join(profile_dir, ring_dir, name)
+                    if len(touched):
+                        with np.load(path) as data:
+                            hit = np.isin(data["nodes"], touched).any()
+                        if hit:
+                            self.invalidated += 1
+                            continue
+                    os.replace(path, os.path.join(target, name))
+                    self.carried_over += 1
+
+    def stats(self):
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+            "evicted_graphs": self.evicted_graphs,
+            "carried_over": self.carried_over,
+            "invalidated": self.invalidated,
+        }
+
+
+def _family(cg):
+    """Identity of a graph's places + network type, shared by all its rebuilds."""
+    ident = {"places": cg.meta.get("places"), "network_type": cg.meta.get("network_type")}
+    return hashlib.sha1(json.dumps(ident, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _unpack(cg, idx, hull):
+    reachable_nodes = cg.node_ids[idx].tolist()
+    if not hull:
+        return reachable_nodes, gpd.GeoDataFrame(geometry=[])
+    return reachable_nodes, gpd.GeoDataFrame(geometry=[wkb.loads(hull)], crs="EPSG:4326")
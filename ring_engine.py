@@ -0,0 +1,403 @@
+import hashlib
+
+import numpy as np
+import geopandas as gpd
+import shapely
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from instrument import count, stage, timed
+from isochrones import ring_polygon, to_lonlat, to_projected
+
+
+# ----------------------------
+# Compiled Graph
+# ----------------------------
+class NodeIndex:
+    """OSM id -> node index map over a sorted copy of the ids.
+
+    Behaves like the {id: index} dict it replaces for single lookups, at
+    12 bytes a node instead of a dict entry with two boxed ints (~100), and
+    lookup() maps whole arrays at once.
+    """
+
+    def __init__(self, node_ids):
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.order = np.argsort(node_ids, kind="stable").astype(np.int32)
+        self.sorted_ids = node_ids[self.order]
+
+    def __len__(self):
+        return len(self.order)
+
+    def _position(self, node):
+        i = int(np.searchsorted(self.sorted_ids, node))
+        return i if i < len(self.order) and self.sorted_ids[i] == node else -1
+
+    def __getitem__(self, node):
+        i = self._position(node)
+        if i < 0:
+            raise KeyError(node)
+        return int(self.order[i])
+
+    def __contains__(self, node):
+        return self._position(node) >= 0
+
+    def get(self, node, default=None):
+        i = self._position(node)
+        return default if i < 0 else int(self.order[i])
+
+    def lookup(self, node_ids):
+        """Node indices (int32) of an array of OSM ids; KeyError on the first unknown one."""
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        if len(self.order) == 0 or len(node_ids) == 0:
+            if len(node_ids):
+                raise KeyError(int(node_ids[0]))
+            return np.empty(0, dtype=np.int32)
+        i = np.minimum(np.searchsorted(self.sorted_ids, node_ids), len(self.order) - 1)
+        found = self.sorted_ids[i] == node_ids
+        if not found.all():
+            raise KeyError(int(node_ids[~found][0]))
+        return self.order[i]
+
+    @property
+    def nbytes(self):
+        return self.order.nbytes + self.sorted_ids.nbytes
+
+
+def _floats(arr):
+    # float32 arrays (from compact()) stay float32; anything else becomes float64
+    arr = np.asarray(arr)
+    return arr if arr.dtype in (np.float32, np.float64) else arr.astype(np.float64)
+
+
+class CompiledGraph:
+    """Road graph held as a CSR adjacency with contiguous weight arrays."""
+
+    def __init__(self, node_ids, x, y, indptr, indices, weights,
+                 node_attrs=None, edge_attrs=None, labels=None, edge_geometry=None):
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.x = _floats(x)
+        self.y = _floats(y)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.weights = {name: _floats(w) for name, w in weights.items()}
+        self.node_attrs = dict(node_attrs or {})  # e.g. site_no, peak_volume
+        self.edge_attrs = dict(edge_attrs or {})  # e.g. length, highway codes
+        self.labels = dict(labels or {})          # category names for coded edge attrs
+        self.edge_geometry = edge_geometry        # (offsets, xy) ragged edge coordinates
+        self.node_index = NodeIndex(self.node_ids)
+        self.key = None   # snapshot key, set when saved or loaded
+        self.path = None  # snapshot directory
+        self.meta = {}    # snapshot metadata, e.g. places and network_type
+        self.tiles = None  # TiledGraph for searches that load only the cells they reach
+        self._matrices = {}
+        self._projected = None
+        self._projected_geometry = None
+        self._in_edges = None
+
+    @property
+    def n_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    def edge_sources(self):
+        """Source node index of every edge, aligned with `indices`."""
+        return np.repeat(np.arange(self.n_nodes, dtype=np.int32), np.diff(self.indptr))
+
+    def out_edges(self, nodes):
+        """Indices of the edges leaving node indices `nodes`."""
+        return index_ranges(self.indptr, np.asarray(nodes, dtype=np.int64))
+
+    def in_edges(self, nodes):
+        """Indices of the edges arriving at node indices `nodes`."""
+        indptr, order = self.in_edge_order()
+        return order[index_ranges(indptr, np.asarray(nodes, dtype=np.int64))]
+
+    def in_edge_order(self):
+        """(indptr, edge order) grouping edges by target node, computed once per graph."""
+        if self._in_edges is None:
+            indptr = np.zeros(self.n_nodes + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=self.n_nodes), out=indptr[1:])
+            self._in_edges = (indptr, np.argsort(self.indices, kind="stable"))
+        return self._in_edges
+
+    @property
+    def profiles(self):
+        return list(self.weights)
+
+    def matrix(self, profile="free_flow"):
+        """Sparse matrix for a weight profile, keeping the cheapest of any parallel edges."""
+        if profile not in self.weights:
+            raise KeyError(f"unknown weight profile {profile!r}, have {self.profiles}")
+        if profile not in self._matrices:
+            self._matrices[profile] = _routing_matrix(
+                self.edge_sources(), self.indices, self.weights[profile], self.n_nodes
+            )
+        return self._matrices[profile]
+
+    def reverse_matrix(self, profile="free_flow"):
+        """matrix(profile) with every edge flipped, for "travel to" searches."""
+        key = ("reverse", profile)
+        if key not in self._matrices:
+            self._matrices[key] = self.matrix(profile).T.tocsr()
+        return self._matrices[key]
+
+    def projected_xy(self):
+        """Node coordinates in PROJECTED_CRS, computed once per graph."""
+        if self._projected is None:
+            self._projected = to_projected(self.x, self.y)
+        return self._projected
+
+    def projected_edge_geometry(self):
+        """(offsets, xy) edge coordinates in PROJECTED_CRS, computed once per graph."""
+        if self._projected_geometry is None:
+            if self.edge_geometry is None:
+                px, py = self.projected_xy()
+                src = self.edge_sources()
+                xy = np.empty((2 * self.n_edges, 2))
+                xy[0::2, 0], xy[0::2, 1] = px[src], py[src]
+                xy[1::2, 0], xy[1::2, 1] = px[self.indices], py[self.indices]
+                offsets = np.arange(0, 2 * self.n_edges + 1, 2, dtype=np.int64)
+            else:
+                offsets, lonlat = self.edge_geometry
+                xy = np.column_stack(to_projected(lonlat[:, 0], lonlat[:, 1]))
+            self._projected_geometry = (np.asarray(offsets), xy)
+        return self._projected_geometry
+
+    def topology_hash(self):
+        """Short hash of node ids and coordinates, stable across weight changes."""
+        h = hashlib.sha1()
+        for arr in (self.node_ids, self.x, self.y):
+            h.update(np.ascontiguousarray(arr).tobytes())
+        return h.hexdigest()[:16]
+
+    def weights_hash(self):
+        """Short hash of the edges and every weight profile; changes whenever a search could."""
+        h = hashlib.sha1()
+        for arr in (self.indptr, self.indices):
+            h.update(np.ascontiguousarray(arr).tobytes())
+        for name in sorted(self.weights):
+            h.update(name.encode())
+            h.update(np.ascontiguousarray(self.weights[name]).tobytes())
+        return h.hexdigest()[:16]
+
+    def edge_labels(self, attr):
+        """Decode a categorical edge attribute (e.g. highway) back to its names."""
+        return np.asarray(self.labels[attr], dtype=object)[self.edge_attrs[attr]]
+
+    def edge_coords(self, e):
+        """(k, 2) lon/lat coordinates of edge `e`, following its geometry if known."""
+        if self.edge_geometry is None:
+            u, v = self.edge_sources()[e], self.indices[e]
+            return np.array([[self.x[u], self.y[u]], [self.x[v], self.y[v]]])
+        offsets, xy = self.edge_geometry
+        return xy[offsets[e]:offsets[e + 1]]
+
+    def compact(self):
+        """Copy with float32 coordinates, weights, lengths, volumes and geometry, and int32 signal sites.
+
+        Roughly halves the stored arrays. Travel times keep about 7
+        significant digits, far under a second on any ring; searches still
+        run in float64 on the routing matrix.
+        """
+        def shrink(name, arr):
+            if name == "site_no":
+                return arr.astype(np.int32)
+            return arr.astype(np.float32) if arr.dtype == np.float64 else arr
+
+        geometry = None
+        if self.edge_geometry is not None:
+            geometry = (self.edge_geometry[0], self.edge_geometry[1].astype(np.float32))
+        cg = CompiledGraph(
+            self.node_ids, self.x.astype(np.float32), self.y.astype(np.float32), self.indptr, self.indices,
+            {name: w.astype(np.float32) for name, w in self.weights.items()},
+            node_attrs={k: shrink(k, v) for k, v in self.node_attrs.items()},
+            edge_attrs={k: shrink(k, v) for k, v in self.edge_attrs.items()},
+            labels=self.labels,
+            edge_geometry=geometry,
+        )
+        cg._projected = self._projected  # projected meters stay float64; 0.5 m steps would show in hulls
+        cg._projected_geometry = self._projected_geometry
+        cg.meta = dict(self.meta)
+        return cg
+
+    def nbytes(self):
+        """Bytes held per part: node arrays, edge arrays (incl. geometry) and cached routing matrices."""
+        nodes = [self.node_ids, self.x, self.y, *self.node_attrs.values()]
+        if self._projected is not None:
+            nodes += list(self._projected)
+        edges = [self.indptr, self.indices, *self.weights.values(), *self.edge_attrs.values()]
+        if self.edge_geometry is not None:
+            edges += list(self.edge_geometry)
+        if self._projected_geometry is not None:
+            edges.append(self._projected_geometry[1])
+        matrices = [a for m in self._matrices.values() for a in (m.data, m.indices, m.indptr)]
+        return {
+            "nodes": int(sum(np.asarray(a).nbytes for a in nodes) + self.node_index.nbytes),
+            "edges": int(sum(np.asarray(a).nbytes for a in edges)),
+            "matrices": int(sum(a.nbytes for a in matrices)),
+        }
+
+    def nearest_node(self, lon, lat):
+        """OSM id of the graph node closest to (lon, lat)."""
+        dx = (self.x - lon) * np.cos(np.radians(lat))
+        dy = self.y - lat
+        return int(self.node_ids[np.argmin(dx * dx + dy * dy)])
+
+
+def index_ranges(indptr, rows):
+    """Concatenated indptr[r]:indptr[r + 1] for every row, without a Python loop."""
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    return np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+
+
+def _routing_matrix(src, dst, w, n):
+    # sort by (src, dst, weight) so the first edge of each pair is the cheapest
+    order = np.lexsort((w, dst, src))
+    src, dst, w = src[order], dst[order], w[order]
+    keep = np.ones(len(src), dtype=bool)
+    keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    src, dst, w = src[keep], dst[keep], w[keep]
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    # explicit zero weights stay in the structure, so csgraph still sees those edges;
+    # float64 here so csgraph doesn't convert compact (float32) weights on every search
+    return csr_matrix((w.astype(np.float64), dst, indptr), shape=(n, n))
+
+
+def compile_graph(G, weights=None, node_attrs=()):
+    """Compile a networkx MultiDiGraph from graph_init into a CompiledGraph.
+
+    `weights` maps profile names to edge attributes; by default the osmnx
+    travel_time becomes the free_flow profile.
+    """
+    weights = weights or {"free_flow": "travel_time"}
+    n = G.number_of_nodes()
+    node_ids = np.fromiter(G.nodes, dtype=np.int64, count=n)
+    index = {node: i for i, node in enumerate(G.nodes)}
+    x = np.fromiter((d["x"] for _, d in G.nodes(data=True)), dtype=np.float64, count=n)
+    y = np.fromiter((d["y"] for _, d in G.nodes(data=True)), dtype=np.float64, count=n)
+
+    # signal attributes only exist on snapped nodes; -1 / nan mark the rest
+    nodes = {}
+    for name in node_attrs:
+        if name == "site_no":
+            nodes[name] = np.fromiter((d.get(name, -1) for _, d in G.nodes(data=True)), dtype=np.int64, count=n)
+        else:
+            nodes[name] = np.fromiter((d.get(name, np.nan) for _, d in G.nodes(data=True)), dtype=np.float64, count=n)
+
+    m = G.number_of_edges()
+    src = np.empty(m, dtype=np.int32)
+    dst = np.empty(m, dtype=np.int32)
+    cols = {name: np.empty(m, dtype=np.float64) for name in weights}
+    length = np.empty(m, dtype=np.float64)
+    highway = []
+    geoms = []
+    for i, (u, v, data) in enumerate(G.edges(data=True)):
+        src[i] = index[u]
+        dst[i] = index[v]
+        for name, attr in weights.items():
+            cols[name][i] = data[attr]
+        length[i] = data.get("length", 0.0)
+        hwy = data.get("highway", "")
+        highway.append(hwy[0] if isinstance(hwy, list) else hwy)
+        if "geometry" in data:
+            geoms.append(np.asarray(data["geometry"].coords, dtype=np.float64))
+        else:
+            geoms.append(np.array([[x[src[i]], y[src[i]]], [x[dst[i]], y[dst[i]]]]))
+
+    order = np.argsort(src, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+
+    highway_labels, highway_codes = np.unique(np.asarray(highway, dtype=str), return_inverse=True)
+    geoms = [geoms[i] for i in order]
+    offsets = np.zeros(m + 1, dtype=np.int64)
+    np.cumsum([len(g) for g in geoms], out=offsets[1:])
+    xy = np.concatenate(geoms) if geoms else np.empty((0, 2))
+
+    return CompiledGraph(
+        node_ids, x, y, indptr, dst[order],
+        {name: w[order] for name, w in cols.items()},
+        node_attrs=nodes,
+        edge_attrs={"length": length[order], "highway": highway_codes[order].astype(np.int16)},
+        labels={"highway": highway_labels.tolist()},
+        edge_geometry=(offsets, xy),
+    )
+
+
+# ----------------------------
+# Shortest Paths
+# ----------------------------
+def travel_times(cg, source, cutoff=20*60, profile="free_flow"):
+    """Travel time from node index `source` to every node, inf beyond cutoff."""
+    return dijkstra(cg.matrix(profile), directed=True, indices=source, limit=cutoff)
+
+
+def reachable(cg, node, cutoff=20*60, profile="free_flow"):
+    """Indices of nodes within cutoff of OSM node `node`, nearest first, and their times."""
+    with stage("search"):
+        dist = travel_times(cg, cg.node_index[node], cutoff=cutoff, profile=profile)
+        idx = np.flatnonzero(np.isfinite(dist))
+        idx = idx[np.argsort(dist[idx], kind="stable")]
+    count("nodes_settled", len(idx))
+    return idx, dist[idx]
+
+
+# ----------------------------
+# Ring Generator
+# ----------------------------
+@timed()
+def generate_ring(cg, node, cutoff=20*60, profile="free_flow", mode="convex"):
+    idx, _ = reachable(cg, node, cutoff=cutoff, profile=profile)
+    if len(idx) == 0:
+        return [], gpd.GeoDataFrame(geometry=[])
+
+    reachable_nodes = cg.node_ids[idx].tolist()
+    with stage("hull"):
+        hull = ring_polygon(cg, idx, mode=mode)  # meters, on coordinates projected once per graph
+    count("hull_vertices", shapely.get_num_coordinates(hull))
+    if hull.is_empty:
+        return reachable_nodes, gpd.GeoDataFrame(geometry=[])
+
+    hull_gdf = gpd.GeoDataFrame(geometry=[to_lonlat(hull)], crs="EPSG:4326")
+    return reachable_nodes, hull_gdf
+
+
+# ----------------------------
+# Banded Rings
+# ----------------------------
+@timed()
+def generate_bands(cg, node, cutoffs=(5*60, 10*60, 15*60, 20*60), profile="free_flow", mode="convex"):
+    """Nested rings for several cutoffs from a single search to the largest one.
+
+    Returns (reachable_nodes, bands_gdf); bands_gdf has one row per cutoff,
+    smallest first, and each band polygon contains the ones inside it.
+    """
+    cutoffs = sorted(cutoffs)
+    idx, times = reachable(cg, node, cutoff=cutoffs[-1], profile=profile)
+    if len(idx) == 0:
+        return [], gpd.GeoDataFrame({"cutoff": []}, geometry=[])
+
+    # times are sorted, so each band is a prefix of the reached nodes
+    ends = np.searchsorted(times, cutoffs, side="right")
+    bands, inner = [], None
+    with stage("hull"):
+        for end in ends:
+            band = ring_polygon(cg, idx[:end], mode=mode)
+            if inner is not None and not inner.covered_by(band):
+                band = band.union(inner)
+            bands.append(band)
+            inner = band
+    count("hull_vertices", int(shapely.get_num_coordinates(bands).sum()))
+
+    bands_gdf = gpd.GeoDataFrame(
+        {"cutoff": cutoffs}, geometry=[to_lonlat(b) for b in bands], crs="EPSG:4326"
+    )
+    return cg.node_ids[idx].tolist(), bands_gdf
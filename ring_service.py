@@ -0,0 +1,395 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.spatial import cKDTree
+
+from coverage import nearest_facility
+from isochrones import ring_polygon, to_lonlat, to_projected
+from ring_engine import reachable
+from signal_delays import add_profile, nearest_nodes, set_site_volumes, signal_delays
+
+LIVE_PROFILE = "live"
+# same rule as the drive peak profile, applied to the latest interval instead of the August average
+LIVE_RULE = {"volume": "live_volume", "per_vehicle": 1 / 200.0, "cap": 120, "default": 10}
+# one 15-minute count -> a 3-hour window summed over a 31-day month, the units the summary (and rule) use
+LIVE_SCALE = 12 * 31
+FEED_TZ = "Australia/Melbourne"  # SCATS interval ends without a UTC offset are local time
+WINDOW = 2048  # samples kept per latency / lag series
+
+
+class NotFound(Exception):
+    """Request for a path the service doesn't serve."""
+
+
+# ----------------------------
+# Feed Parsing
+# ----------------------------
+def parse_update(line):
+    """(site, volume, interval end as epoch seconds or None) from a JSON or "site,volume[,end]" line.
+
+    An end time without a UTC offset is taken as FEED_TZ local time.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith("{"):
+        record = json.loads(line)
+        site, volume, end = record["site"], record["volume"], record.get("end")
+    else:
+        site, volume, *rest = line.split(",")
+        end = rest[0] if rest else None
+    if end:
+        stamp = pd.Timestamp(end)
+        if stamp.tzinfo is None:
+            stamp = stamp.tz_localize(FEED_TZ, ambiguous=True, nonexistent="shift_forward")
+        end = stamp.timestamp()
+    else:
+        end = None
+    return int(site), float(volume), end
+
+
+def _delay_rule(rule):
+    return {k: v for k, v in rule.items() if k != "volume"}
+
+
+# ----------------------------
+# Service
+# ----------------------------
+class RingService:
+    """Warm drive graph whose live profile follows a SCATS interval feed, answering ring and coverage queries.
+
+    Feed lines are buffered per site and applied in batches every
+    `batch_seconds` with set_site_volumes, so only edges around the sites
+    that changed are re-weighted. Searches and updates run one at a time on
+    a single worker thread, which keeps the event loop free for requests and
+    means a search never sees a half-applied batch. Rings are remembered
+    until an update re-weights an edge their search reached; concurrent
+    requests for the same ring or coverage field share one computation.
+    """
+
+    def __init__(self, engine, facilities=None, rule=LIVE_RULE, seed_column="peak_volume", scale=LIVE_SCALE,
+                 batch_seconds=1.0, mode="convex", max_rings=4096):
+        self.engine = engine
+        self.facilities = {name: [int(n) for n in nodes] for name, nodes in (facilities or {}).items()}
+        self.rule = dict(rule)
+        self.scale = scale
+        self.batch_seconds = batch_seconds
+        self.mode = mode
+        self.max_rings = max_rings
+
+        # the live profile starts from the static summary until the feed says otherwise
+        column = self.rule["volume"]
+        engine.node_attrs[column] = np.array(engine.node_attrs[seed_column], dtype=np.float64)
+        add_profile(engine, LIVE_PROFILE, signal_delays(engine.node_attrs[column], **_delay_rule(self.rule)))
+
+        self.tree = cKDTree(np.column_stack(engine.projected_xy()))  # built once for per-request snapping
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        self.version = 0
+        self.pending = {}
+        self.rings = OrderedDict()
+        self.fields = {}
+        self.inflight = {}
+        self.latency = defaultdict(lambda: deque(maxlen=WINDOW))
+        self.apply_lag = deque(maxlen=WINDOW)
+        self.feed_lag = deque(maxlen=WINDOW)
+        self.counts = defaultdict(int)
+
+    # --- updates ---
+    def ingest(self, line):
+        """Buffer one feed line; the latest value per site wins within a batch."""
+        try:
+            update = parse_update(line)
+        except (ValueError, KeyError) as e:
+            self.counts["bad_lines"] += 1
+            print(f"skipping feed line {line.strip()!r}: {e}")
+            return
+        if update is not None:
+            site, volume, end = update
+            self.pending[site] = (volume, time.time(), end)
+            self.counts["updates_received"] += 1
+
+    def _apply(self, batch):
+        volumes = pd.DataFrame(
+            {self.rule["volume"]: [volume * self.scale for volume, _, _ in batch.values()]}, index=list(batch)
+        )
+        nodes, edges = set_site_volumes(self.engine, volumes, {LIVE_PROFILE: self.rule})
+        moved = edges[LIVE_PROFILE]
+        if len(moved):
+            # a ring only changes if its search reached the source of a re-weighted edge
+            touched = np.unique(np.searchsorted(self.engine.indptr, moved, side="right") - 1)
+            stale = [key for key, (idx, _) in self.rings.items() if np.isin(idx, touched).any()]
+            for key in stale:
+                del self.rings[key]
+            self.fields.clear()
+            self.version += 1
+            self.counts["rings_invalidated"] += len(stale)
+        self.counts["nodes_changed"] += len(nodes)
+        self.counts["edges_reweighted"] += len(moved)
+
+    async def flush_updates(self):
+        """Apply buffered feed updates every batch_seconds, forever."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.batch_seconds)
+            if not self.pending:
+                continue
+            batch, self.pending = self.pending, {}
+            await loop.run_in_executor(self.worker, self._apply, batch)
+            now = time.time()
+            for _, received, end in batch.values():
+                self.apply_lag.append(now - received)
+                if end is not None:
+                    self.feed_lag.append(now - end)
+            self.counts["batches"] += 1
+
+    async def tail_file(self, path, from_start=False):
+        """Follow a growing feed file (like tail -F), starting at its end unless from_start."""
+        while not os.path.exists(path):
+            await asyncio.sleep(0.5)
+        f = open(path)
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+        partial = ""
+        while True:
+            chunk = f.readline()
+            if not chunk:
+                if os.path.getsize(path) < f.tell():  # truncated or rotated
+                    f.seek(0)
+                await asyncio.sleep(0.2)
+                continue
+            partial += chunk
+            if partial.endswith("\n"):
+                self.ingest(partial)
+                partial = ""
+
+    async def _feed_client(self, reader, writer):
+        while line := await reader.readline():
+            self.ingest(line.decode())
+        writer.close()
+
+    async def serve_feed(self, host, port):
+        """Accept feed lines over TCP, e.g. `nc localhost <port> < intervals.csv`."""
+        return await asyncio.start_server(self._feed_client, host, port)
+
+    # --- queries ---
+    def snap(self, lon, lat):
+        """Node index nearest to (lon, lat)."""
+        x, y = to_projected(np.atleast_1d(lon), np.atleast_1d(lat))
+        return int(self.tree.query([x[0], y[0]])[1])
+
+    async def _once(self, key, fn, *args):
+        """Run fn(*args) on the graph worker, sharing the result with identical in-flight requests."""
+        if key in self.inflight:
+            self.counts["coalesced"] += 1
+            return await asyncio.shield(self.inflight[key])
+        future = asyncio.get_running_loop().run_in_executor(self.worker, fn, *args)
+        self.inflight[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+
+    def _ring(self, node, cutoff):
+        key = (node, cutoff)
+        if key not in self.rings:
+            idx, _ = reachable(self.engine, node, cutoff=cutoff, profile=LIVE_PROFILE)
+            hull = ring_polygon(self.engine, idx, mode=self.mode) if len(idx) else shapely.Polygon()
+            feature = {
+                "type": "Feature",
+                "geometry": shapely.geometry.mapping(to_lonlat(hull)) if not hull.is_empty else None,
+                "properties": {"node": node, "cutoff": cutoff, "reached": int(len(idx))},
+            }
+            self.rings[key] = (idx, feature)
+            while len(self.rings) > self.max_rings:
+                self.rings.popitem(last=False)
+        self.rings.move_to_end(key)
+        return {**self.rings[key][1], "version": self.version}
+
+    def _field(self, name, cutoff):
+        key = (name, cutoff)
+        if key not in self.fields:
+            self.fields[key] = nearest_facility(self.engine, self.facilities[name], LIVE_PROFILE, cutoff=cutoff)
+        return self.fields[key]
+
+    async def ring(self, node, cutoff):
+        if (node, cutoff) in self.rings:
+            self.counts["ring_hits"] += 1
+        return await self._once(("ring", node, cutoff, self.version), self._ring, node, cutoff)
+
+    async def coverage(self, name, cutoff, lon=None, lat=None):
+        times, facility = await self._once(("coverage", name, cutoff, self.version), self._field, name, cutoff)
+        if lon is not None:
+            idx = self.snap(lon, lat)
+            best = int(facility[idx])
+            return {"seconds": float(times[idx]) if np.isfinite(times[idx]) else None,
+                    "facility": self.facilities[name][best] if best >= 0 else None, "version": self.version}
+        covered = np.isfinite(times)
+        return {"nodes": int(len(times)), "covered": int(covered.sum()), "share": float(covered.mean()),
+                "median_s": float(np.median(times[covered])) if covered.any() else None, "version": self.version}
+
+    def metrics(self):
+        def summary(samples):
+            if not samples:
+                return {"n": 0}
+            p50, p90, p99 = np.percentile(np.asarray(samples), [50, 90, 99])
+            return {"n": len(samples), "p50": round(p50, 4), "p90": round(p90, 4), "p99": round(p99, 4),
+                    "max": round(max(samples), 4)}
+
+        return {
+            "version": self.version,
+            "pending_sites": len(self.pending),
+            "cached_rings": len(self.rings),
+            "latency_s": {route: summary(samples) for route, samples in self.latency.items()},
+            "apply_lag_s": summary(self.apply_lag),
+            "feed_lag_s": summary(self.feed_lag),
+            **self.counts,
+        }
+
+    # --- HTTP ---
+    @staticmethod
+    def _point(query):
+        """(lon, lat) from the query, or (None, None) when neither is given."""
+        if "lon" not in query and "lat" not in query:
+            return None, None
+        if "lon" not in query or "lat" not in query:
+            raise ValueError("lon and lat must be given together")
+        lon, lat = float(query["lon"]), float(query["lat"])
+        if not (np.isfinite(lon) and np.isfinite(lat)):
+            raise ValueError("lon and lat must be finite")
+        return lon, lat
+
+    def _node(self, query):
+        if "node" in query:
+            node = int(query["node"])
+            if node not in self.engine.node_index:
+                raise ValueError(f"unknown node {node}")
+            return node
+        lon, lat = self._point(query)
+        if lon is None:
+            raise ValueError("give node, or lon and lat")
+        return int(self.engine.node_ids[self.snap(lon, lat)])
+
+    async def _route(self, path, query):
+        cutoff = float(query.get("cutoff", 20*60))
+        if path == "/ring":
+            return await self.ring(self._node(query), cutoff)
+        if path == "/coverage":
+            name = query.get("set") or next(iter(self.facilities), None)
+            if name not in self.facilities:
+                raise ValueError(f"unknown facility set {name!r}, have {list(self.facilities)}")
+            return await self.coverage(name, cutoff, *self._point(query))
+        if path == "/metrics":
+            return self.metrics()
+        if path == "/health":
+            return {"ok": True, "version": self.version}
+        raise NotFound(path)
+
+    async def _http_client(self, reader, writer):
+        start = time.perf_counter()
+        url = None
+        try:
+            request = (await reader.readline()).decode()
+            while (await reader.readline()).strip():
+                pass  # headers aren't needed
+            method, target, _ = request.split(" ", 2)
+            url = urlsplit(target)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            status, body = 200, await self._route(url.path, query)
+        except NotFound as e:
+            status, body = 404, {"error": f"no route {e}"}
+        except (ValueError, KeyError) as e:
+            status, body = 400, {"error": str(e)}
+        except Exception as e:
+            status, body = 500, {"error": f"{type(e).__name__}: {e}"}
+            print(f"{url.path if url else '?'}: {status} {body['error']}")
+
+        try:
+            payload = json.dumps(body).encode()
+            writer.write(
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+        if status == 200:
+            self.latency[url.path].append(time.perf_counter() - start)
+
+    async def serve_http(self, host, port):
+        return await asyncio.start_server(self._http_client, host, port)
+
+
+# ----------------------------
+# Stand-in Feed
+# ----------------------------
+async def replay_feed(path, volume_csv, every=15.0, share=0.05, seed=0):
+    """Append synthetic 15-minute counts for a random share of sites to `path` every `every` seconds.
+
+    Each count is the site's August peak average for one interval times a
+    random factor, so incidents (x3) and quiet spells (x0.3) both show up.
+    """
+    rng = np.random.default_rng(seed)
+    summary = pd.read_csv(volume_csv).dropna()
+    while True:
+        picked = summary.sample(max(1, int(len(summary) * share)), random_state=rng)
+        factor = rng.choice([0.3, 1.0, 3.0], size=len(picked), p=[0.2, 0.6, 0.2])
+        end = pd.Timestamp.now(tz="UTC").isoformat()
+        with open(path, "a") as f:
+            for site, volume, k in zip(picked["NB_SCATS_SITE"], picked["peak_volume"], factor):
+                f.write(json.dumps({"site": int(site), "volume": round(volume / LIVE_SCALE * k, 1), "end": end}) + "\n")
+        await asyncio.sleep(every)
+
+
+async def main(args):
+    import drive_graph
+    from run_jobs import fetch_features
+
+    engine = drive_graph.graph_init(args.places, args.traffic_geojson, args.volume_csv, extract=args.extract)
+    facilities = {}
+    for tag in args.amenity:
+        features = fetch_features(args.places, {"amenity": tag})
+        idx, _ = nearest_nodes(engine, features.geometry.x.to_numpy(), features.geometry.y.to_numpy())
+        facilities[tag] = engine.node_ids[np.unique(idx)].tolist()
+    service = RingService(engine, facilities, batch_seconds=args.batch_seconds)
+
+    tasks = [service.flush_updates()]
+    if args.feed:
+        tasks.append(service.tail_file(args.feed, from_start=args.from_start))
+    if args.feed_port:
+        await service.serve_feed(args.host, args.feed_port)
+    if args.simulate:
+        tasks.append(replay_feed(args.feed, args.volume_csv, every=args.simulate))
+    await service.serve_http(args.host, args.port)
+    print(f"serving on http://{args.host}:{args.port} (/ring, /coverage, /metrics), facilities: "
+          + ", ".join(f"{k}={len(v)}" for k, v in facilities.items()))
+    await asyncio.gather(*tasks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the drive graph warm and serve live rings over HTTP.")
+    parser.add_argument("--places", nargs="+", default=["City of Melbourne, Victoria, Australia"])
+    parser.add_argument("--traffic-geojson", default="Traffic_Lights.geojson")
+    parser.add_argument("--volume-csv", default="Traffic_Volumes_Summary.csv")
+    parser.add_argument("--extract", help="local .osm/.osm.pbf to build the graph from")
+    parser.add_argument("--amenity", nargs="*", default=["school"], help="facility sets for /coverage")
+    parser.add_argument("--feed", help="file of interval lines to follow")
+    parser.add_argument("--from-start", action="store_true", help="read the feed file from the beginning")
+    parser.add_argument("--feed-port", type=int, help="also accept feed lines on this TCP port")
+    parser.add_argument("--simulate", type=float, help="append synthetic counts to --feed every N seconds")
+    parser.add_argument("--batch-seconds", type=float, default=1.0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    if args.simulate and not args.feed:
+        parser.error("--simulate needs --feed")
+    asyncio.run(main(args))
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from ring_engine import CompiledGraph
+from ring_service import FEED_TZ, RingService, parse_update, replay_feed
+
+# Run in a timezone well away from UTC, so naive and UTC timestamps can't agree by accident
+os.environ["TZ"] = "America/New_York"
+time.tzset()
+
+
+def test_replayed_feed_lag_is_near_zero():
+    with tempfile.TemporaryDirectory() as directory:
+        volume_csv = os.path.join(directory, "volumes.csv")
+        pd.DataFrame({"NB_SCATS_SITE": [1, 2], "peak_volume": [9000.0, 4000.0]}).to_csv(volume_csv, index=False)
+        feed = os.path.join(directory, "feed.jsonl")
+
+        async def one_round():
+            try:
+                await asyncio.wait_for(replay_feed(feed, volume_csv, every=60.0, share=1.0), timeout=0.5)
+            except asyncio.TimeoutError:
+                pass
+
+        asyncio.run(one_round())
+        with open(feed) as f:
+            updates = [parse_update(line) for line in f]
+    assert updates
+    for _, _, end in updates:
+        assert abs(time.time() - end) < 60
+
+
+def test_naive_end_is_feed_local_time():
+    local = pd.Timestamp.now(tz=FEED_TZ).tz_localize(None).isoformat()
+    _, _, end = parse_update(json.dumps({"site": 1, "volume": 10.0, "end": local}))
+    assert abs(time.time() - end) < 60
+    _, _, end = parse_update(f"1,10,{pd.Timestamp.now(tz='UTC').isoformat()}")
+    assert abs(time.time() - end) < 60
+
+
+def _service():
+    """RingService on a 3 x 3 lattice near Parkville, one signal in the middle."""
+    lon, lat = np.meshgrid(144.95 + 0.001 * np.arange(3), -37.79 + 0.001 * np.arange(3))
+    src, dst = [], []
+    for i in range(9):
+        for j in (i - 3, i - 1, i + 1, i + 3):
+            if 0 <= j < 9 and (abs(i - j) == 3 or i // 3 == j // 3):
+                src.append(i)
+                dst.append(j)
+    indptr = np.searchsorted(src, np.arange(10))
+    volume = np.full(9, np.nan)
+    volume[4] = 9000.0
+    engine = CompiledGraph(np.arange(9) + 100, lon.ravel(), lat.ravel(), indptr, dst,
+                           {"free_flow": np.full(len(dst), 10.0)}, node_attrs={"peak_volume": volume})
+    return RingService(engine, facilities={"gp": [104]})
+
+
+def _get(service, target):
+    async def fetch():
+        server = await service.serve_http("127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(f"GET {target} HTTP/1.1\r\nHost: test\r\n\r\n".encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout=5)  # returns once the server closes
+        writer.close()
+        server.close()
+        return response
+
+    head, body = asyncio.run(fetch()).decode().split("\r\n\r\n", 1)
+    return int(head.split()[1]), json.loads(body)
+
+
+def test_http_status_codes():
+    service = _service()
+    assert _get(service, "/health")[0] == 200
+    assert _get(service, "/ring?node=104&cutoff=60")[0] == 200
+    assert _get(service, "/coverage?lon=144.951&lat=-37.789")[0] == 200
+    assert _get(service, "/nowhere")[0] == 404
+    for target in ("/ring?lon=144.9", "/ring", "/coverage?lon=144.9", "/ring?lon=nan&lat=-37.8", "/ring?node=1"):
+        status, body = _get(service, target)
+        assert status == 400, (target, status, body)
+
+    async def broken(node, cutoff):
+        raise RuntimeError("search failed")
+
+    service.ring = broken
+    assert _get(service, "/ring?node=104") == (500, {"error": "RuntimeError: search failed"})
+
+
+if __name__ == "__main__":
+    test_replayed_feed_lag_is_near_zero()
+    test_naive_end_is_feed_local_time()
+    test_http_status_codes()
+    print("ring_service feed timestamps and HTTP status codes ok")
@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import time
+
+import osmnx as ox
+
+import bike_graph
+import drive_graph
+import instrument
+import walk_graph
+from ring_cache import RingCache
+
+# graph_init and plot_all_rings per network type
+NETWORKS = {"drive": drive_graph, "walk": walk_graph, "bike": bike_graph}
+
+RENDER_STAGES = ("network", "basemap", "markers", "hulls", "save", "web")
+
+
+# ----------------------------
+# Shared Inputs
+# ----------------------------
+def load_manifest(path):
+    """Read a job manifest, filling each job's places and inputs from the top-level defaults."""
+    with open(path) as f:
+        manifest = json.load(f)
+    defaults = {k: v for k, v in manifest.items() if k != "jobs"}
+    jobs = []
+    for job in manifest["jobs"]:
+        job = {**defaults, **job}
+        if job["network_type"] not in NETWORKS:
+            raise ValueError(f"unknown network_type {job['network_type']!r}, expected one of {list(NETWORKS)}")
+        jobs.append(job)
+    return jobs
+
+
+def fetch_features(places, tags, name_contains=None):
+    """Facility points for one tag set: polygon centroids taken in meters, back in lon/lat."""
+    features = ox.features_from_place(places, tags)
+    if name_contains:
+        features = features[features["name"].str.contains(name_contains, case=False, na=False)]
+    features = features.to_crs(epsg=32755)
+    features["geometry"] = features.centroid.to_crs(epsg=4326)
+    return features
+
+
+def _key(*parts):
+    return json.dumps(parts, sort_keys=True)
+
+
+# ----------------------------
+# Job Runner
+# ----------------------------
+def run_jobs(jobs, workers=None, cache=None):
+    """Run every job, building each network and fetching each feature set only once.
+
+    Jobs run in manifest order; a graph or feature set is loaded the first
+    time a job needs it and reused by every later job, and rings shared by
+    jobs that differ only in styling or output come from the RingCache.
+    Ring searches within a job are spread over `workers` processes.
+    Returns one timing row per job.
+    """
+    cache = cache or RingCache()
+    graphs, feature_sets, rows = {}, {}, []
+
+    for job in jobs:
+        start = time.perf_counter()
+        module = NETWORKS[job["network_type"]]
+        row = {"output": job["output"], "network_type": job["network_type"], "profile": job["profile"],
+               "graph_s": 0.0, "features_s": 0.0}
+
+        graph_key = _key(job["network_type"], job["places"], job["traffic_geojson"], job["volume_csv"], job.get("extract"),
+                         job.get("tile_size"), bool(job.get("compact")))
+        if graph_key not in graphs:
+            t = time.perf_counter()
+            graphs[graph_key] = module.graph_init(
+                job["places"], job["traffic_geojson"], job["volume_csv"], extract=job.get("extract"),
+                tile_size=job.get("tile_size"), compact=bool(job.get("compact")),
+            )
+            row["graph_s"] = time.perf_counter() - t
+
+        features_key = _key(job["places"], job["tags"], job.get("name_contains"))
+        if features_key not in feature_sets:
+            t = time.perf_counter()
+            feature_sets[features_key] = fetch_features(job["places"], job["tags"], job.get("name_contains"))
+            row["features_s"] = time.perf_counter() - t
+
+        os.makedirs(os.path.dirname(job["output"]) or ".", exist_ok=True)
+        timer = module.plot_all_rings(
+            graphs[graph_key],
+            feature_sets[features_key],
+            cutoff=job.get("cutoff", 20*60),
+            profile=job["profile"],
+            hull_mode=job.get("hull_mode", "convex"),
+            workers=workers,
+            cache=cache,
+            bands=job.get("bands"),
+            dpi=job.get("dpi", 300),
+            web_budget=job.get("web_budget"),
+            output=job["output"],
+        )
+        row["features"] = len(feature_sets[features_key])
+        row.update(timer.info["facilities"])  # distinct source nodes, snap distances
+        row["rings_s"] = timer.seconds["rings"] + timer.seconds["snap"]
+        row["render_s"] = sum(timer.seconds[stage] for stage in RENDER_STAGES)
+        row["total_s"] = time.perf_counter() - start
+        rows.append(row)
+        print(f"done {job['output']} in {row['total_s']:.1f}s")
+    return rows
+
+
+def timing_summary(rows):
+    header = f"{'output':<48} {'n':>5} {'srcs':>5} {'graph':>7} {'feats':>7} {'rings':>7} {'render':>7} {'total':>7}"
+    lines = [header, "-" * len(header)]
+    for r in rows:
+        lines.append(
+            f"{r['output'][-48:]:<48} {r['features']:>5} {r['sources']:>5} {r['graph_s']:>7.1f} {r['features_s']:>7.1f} "
+            f"{r['rings_s']:>7.1f} {r['render_s']:>7.1f} {r['total_s']:>7.1f}"
+        )
+    lines.append(f"{len(rows)} job(s) in {sum(r['total_s'] for r in rows):.1f}s")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render every map in a job manifest in one run.")
+    parser.add_argument("manifest", nargs="?", default="jobs.json")
+    parser.add_argument("--workers", type=int, help="processes for the ring searches (default: all cores)")
+    parser.add_argument("--profile", help="write a JSON run profile here, plus a .folded flame-graph trace")
+    args = parser.parse_args()
+    if args.profile:
+        instrument.enable()
+
+    cache = RingCache()
+    rows = run_jobs(load_manifest(args.manifest), workers=args.workers, cache=cache)
+    print(timing_summary(rows))
+    print("ring cache:", cache.stats())
+    if args.profile:
+        instrument.write_report(args.profile)
+        instrument.write_trace(os.path.splitext(args.profile)[0] + ".folded")
@@ -0,0 +1,211 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from scipy.spatial import cKDTree
+
+from isochrones import to_projected
+
+
+# ----------------------------
+# Signal Snapping
+# ----------------------------
+def nearest_nodes(cg, lon, lat):
+    """Bulk nearest-node query: node indices and distances in meters."""
+    px, py = cg.projected_xy()
+    tree = cKDTree(np.column_stack([px, py]))
+    qx, qy = to_projected(np.atleast_1d(lon), np.atleast_1d(lat))
+    dist, idx = tree.query(np.column_stack([qx, qy]))
+    return idx, dist
+
+
+def lights_hash(traffic_lights):
+    """sha1 of a lights file's contents, or of a GeoDataFrame's SITE_NO and coordinates."""
+    h = hashlib.sha1()
+    if isinstance(traffic_lights, str):
+        with open(traffic_lights, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    else:
+        for arr in (traffic_lights["SITE_NO"], traffic_lights.geometry.x, traffic_lights.geometry.y):
+            h.update(np.ascontiguousarray(arr.to_numpy()).tobytes())
+    return h.hexdigest()[:16]
+
+
+def snap_signals(cg, traffic_lights, mapping_csv=None):
+    """Snap every traffic light to its nearest node in one KD-tree query.
+
+    The result is written to (and reused from) mapping_csv in the
+    TrafficLight_Node_Mapping.csv format, as long as it was made for this
+    graph and these lights.
+    """
+    version = cg.topology_hash()
+    source = lights_hash(traffic_lights)
+    if mapping_csv and os.path.exists(mapping_csv):
+        cached = pd.read_csv(mapping_csv, dtype={"graph_version": str, "lights_version": str})
+        if ("graph_version" in cached and "lights_version" in cached
+                and (cached["graph_version"] == version).all() and (cached["lights_version"] == source).all()):
+            return cached
+
+    if isinstance(traffic_lights, str):
+        traffic_lights = gpd.read_file(traffic_lights)
+    idx, dist = nearest_nodes(cg, traffic_lights.geometry.x.to_numpy(), traffic_lights.geometry.y.to_numpy())
+
+    mapping = pd.DataFrame({
+        "SITE_NO": traffic_lights["SITE_NO"].to_numpy(),
+        "node_id": cg.node_ids[idx],
+        "node_lon": cg.x[idx],
+        "node_lat": cg.y[idx],
+        "snap_dist_m": np.round(dist, 2),
+        "graph_version": version,
+        "lights_version": source,
+    })
+    if mapping_csv:
+        mapping.to_csv(mapping_csv, index=False)
+    return mapping
+
+
+def attach_volumes(cg, mapping, volume_csv, columns=None):
+    """Join volumes onto snapped signals and store them as node attribute arrays.
+
+    Every volume column in the summary is attached unless `columns` narrows
+    it. Signals without volume data get 0, nodes without a signal get nan,
+    and when several lights land on one node the last one wins.
+    """
+    volumes = pd.read_csv(volume_csv)
+    if columns is None:
+        columns = [c for c in volumes.columns if c != "NB_SCATS_SITE"]
+    volumes = volumes[["NB_SCATS_SITE", *columns]]
+    merged = mapping[["SITE_NO", "node_id"]].merge(
+        volumes, how="left", left_on="SITE_NO", right_on="NB_SCATS_SITE"
+    )
+    merged[list(columns)] = merged[list(columns)].fillna(0)
+    merged = merged.drop_duplicates("node_id", keep="last")
+
+    idx = cg.node_index.lookup(merged["node_id"].to_numpy())
+    site_no = np.full(cg.n_nodes, -1, dtype=np.int64)
+    site_no[idx] = merged["SITE_NO"].to_numpy()
+    cg.node_attrs["site_no"] = site_no
+    for name in columns:
+        values = np.full(cg.n_nodes, np.nan)
+        values[idx] = merged[name].to_numpy(dtype=np.float64)
+        cg.node_attrs[name] = values
+
+
+# ----------------------------
+# Delay Injection
+# ----------------------------
+def signal_delays(volume, per_vehicle=None, fixed=None, cap=None, default=0.0):
+    """Per-node delay in seconds from a volume array.
+
+    Signalised nodes with traffic get `fixed` seconds, or volume * per_vehicle
+    capped at `cap`; every other node gets `default`.
+    """
+    volume = np.nan_to_num(np.asarray(volume, dtype=np.float64), nan=0.0)
+    if fixed is not None:
+        delay = np.full(len(volume), float(fixed))
+    else:
+        delay = volume * per_vehicle
+        if cap is not None:
+            delay = np.minimum(delay, cap)
+    return np.where(volume > 0, delay, default)
+
+
+def add_profile(cg, name, delay, base="free_flow"):
+    """Add a weight profile: `base` plus each node's delay on its in- and out-edges.
+
+    The base weights are left untouched, so every profile lives side by side.
+    """
+    weights = cg.weights[base] + delay[cg.edge_sources()] + delay[cg.indices]
+    cg.weights[name] = weights.astype(cg.weights[base].dtype, copy=False)  # compact graphs stay float32
+    cg._matrices.pop(name, None)
+    cg._matrices.pop(("reverse", name), None)
+
+
+def add_profiles(cg, profiles, base="free_flow"):
+    """Build every profile in {name: {"volume": column, **delay rule}} from node volumes."""
+    for name, spec in profiles.items():
+        rule = dict(spec)
+        column = rule.pop("volume")
+        if column not in cg.node_attrs:
+            raise KeyError(f"profile {name!r}: no volume column {column!r} on the graph")
+        add_profile(cg, name, signal_delays(cg.node_attrs[column], **rule), base=base)
+
+
+# ----------------------------
+# Incremental Updates
+# ----------------------------
+def update_volumes(cg, volume_csv, profiles, base="free_flow"):
+    """Apply a new volume summary to a finished graph, touching only what changed.
+
+    Sites missing from the summary drop to 0, as in attach_volumes. See
+    set_site_volumes for what gets patched. Returns (changed node indices,
+    {profile: indices of edges whose weight changed}).
+    """
+    volumes = pd.read_csv(volume_csv).drop_duplicates("NB_SCATS_SITE", keep="last").set_index("NB_SCATS_SITE")
+    return set_site_volumes(cg, volumes, profiles, base=base, complete=True)
+
+
+def set_site_volumes(cg, volumes, profiles, base="free_flow", complete=False):
+    """Set volumes for some sites and re-weight just the edges around them.
+
+    `volumes` is indexed by SCATS site with one column per volume attribute.
+    Signalised nodes whose values differ take the new ones; with `complete`
+    every other site is set to 0, otherwise it keeps its values. Then, per
+    profile, only the in- and out-edges of the changed nodes are re-weighted,
+    and any cached routing matrices are patched to match. Read-only
+    (memory-mapped) arrays are copied before writing, so load a snapshot with
+    mmap_mode="c" to keep the copy to the touched pages.
+    Returns (changed node indices, {profile: indices of edges whose weight changed}).
+    """
+    signalised = np.flatnonzero(cg.node_attrs["site_no"] >= 0)
+    if not complete:
+        signalised = signalised[np.isin(cg.node_attrs["site_no"][signalised], volumes.index)]
+    columns = [c for c in volumes.columns if c in cg.node_attrs and c != "site_no"]
+    new = volumes.reindex(cg.node_attrs["site_no"][signalised])[columns].fillna(0).to_numpy(dtype=np.float64)
+    old = np.column_stack([cg.node_attrs[c][signalised] for c in columns]) if columns else new
+    differs = (new != old).any(axis=1)
+    nodes = signalised[differs]
+    for j, name in enumerate(columns):
+        cg.node_attrs[name] = _writable(cg.node_attrs[name])
+        cg.node_attrs[name][nodes] = new[differs, j]
+
+    edges = np.unique(np.concatenate([cg.out_edges(nodes), cg.in_edges(nodes)]))
+    src = np.searchsorted(cg.indptr, edges, side="right") - 1
+    dst = cg.indices[edges]
+    changed = {}
+    for name, spec in profiles.items():
+        rule = dict(spec)
+        column = rule.pop("volume")
+        # same sum, in the same order, as add_profile, so untouched edges compare equal
+        weights = (cg.weights[base][edges] + signal_delays(cg.node_attrs[column][src], **rule)
+                   + signal_delays(cg.node_attrs[column][dst], **rule)).astype(cg.weights[name].dtype)
+        moved = weights != cg.weights[name][edges]
+        cg.weights[name] = _writable(cg.weights[name])
+        cg.weights[name][edges[moved]] = weights[moved]
+        _patch_matrices(cg, name, src[moved], dst[moved])
+        changed[name] = edges[moved]
+    return nodes, changed
+
+
+def _writable(arr):
+    return arr if arr.flags.writeable else np.array(arr)
+
+
+def _patch_matrices(cg, profile, src, dst):
+    """Refresh the cached (forward and reverse) matrices of `profile` for edges src -> dst."""
+    weights = cg.weights[profile]
+    for key, rows, cols in ((profile, src, dst), (("reverse", profile), dst, src)):
+        matrix = cg._matrices.get(key)
+        if matrix is None:
+            continue
+        if not matrix.has_sorted_indices:
+            cg._matrices.pop(key)  # rebuilt on next use
+            continue
+        for row, col, u, v in zip(rows.tolist(), cols.tolist(), src.tolist(), dst.tolist()):
+            lo, hi = cg.indptr[u], cg.indptr[u + 1]
+            start, stop = matrix.indptr[row], matrix.indptr[row + 1]
+            # parallel edges share one matrix entry holding the cheapest
+            matrix.data[start + np.searchsorted(matrix.indices[start:stop], col)] = weights[lo:hi][cg.indices[lo:hi] == v].min()
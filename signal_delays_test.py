@@ -0,0 +1,87 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from ring_engine import CompiledGraph
+from signal_delays import add_profiles, attach_volumes, update_volumes
+
+PROFILES = {
+    "offpeak": {"volume": "offpeak_volume", "per_vehicle": 1 / 200.0, "cap": 120, "default": 10},
+    "peak": {"volume": "peak_volume", "per_vehicle": 1 / 200.0, "cap": 120, "default": 10},
+    "fixed": {"volume": "peak_volume", "fixed": 30},
+}
+
+
+def grid(n=12, seed=0):
+    """n x n two-way grid with random free-flow times."""
+    rng = np.random.default_rng(seed)
+    lon, lat = np.meshgrid(144.95 + 0.001 * np.arange(n), -37.80 + 0.001 * np.arange(n))
+    src, dst = [], []
+    for i in range(n * n):
+        r, c = divmod(i, n)
+        for j, ok in ((i - n, r > 0), (i + n, r < n - 1), (i - 1, c > 0), (i + 1, c < n - 1)):
+            if ok:
+                src.append(i)
+                dst.append(j)
+    indptr = np.searchsorted(src, np.arange(n * n + 1))
+    return CompiledGraph(np.arange(n * n) + 500, lon.ravel(), lat.ravel(), indptr, dst,
+                         {"free_flow": rng.uniform(5, 20, len(dst))})
+
+
+def _summary(path, sites, rng):
+    pd.DataFrame({
+        "NB_SCATS_SITE": sites,
+        "offpeak_volume": rng.integers(0, 20000, len(sites)).astype(float),
+        "peak_volume": rng.integers(0, 40000, len(sites)).astype(float),
+    }).to_csv(path, index=False)
+
+
+def _rebuild(mapping, volume_csv, compact):
+    cg = grid()
+    cg = cg.compact() if compact else cg
+    attach_volumes(cg, mapping, volume_csv)
+    add_profiles(cg, PROFILES)
+    return cg
+
+
+def check_update_matches_rebuild(compact):
+    rng = np.random.default_rng(1)
+    nodes = rng.choice(grid().node_ids, 30, replace=False)
+    # two lights share a node, and one site has no light at all
+    mapping = pd.DataFrame({"SITE_NO": np.arange(31) + 1, "node_id": np.append(nodes, nodes[0])})
+    with tempfile.TemporaryDirectory() as directory:
+        old, new = os.path.join(directory, "old.csv"), os.path.join(directory, "new.csv")
+        _summary(old, np.arange(31) + 1, rng)
+        _summary(new, np.append(rng.choice(np.arange(31) + 1, 20, replace=False), 99), rng)  # others drop to 0
+
+        cg = _rebuild(mapping, old, compact)
+        for profile in cg.profiles:
+            cg.matrix(profile)
+            cg.reverse_matrix(profile)
+        update_volumes(cg, new, PROFILES)
+        rebuilt = _rebuild(mapping, new, compact)
+
+    for name, values in rebuilt.node_attrs.items():
+        assert np.array_equal(cg.node_attrs[name], values, equal_nan=True), name
+    for profile, weights in rebuilt.weights.items():
+        assert cg.weights[profile].dtype == weights.dtype
+        assert np.array_equal(cg.weights[profile], weights), profile
+        for patched, fresh in ((cg.matrix(profile), rebuilt.matrix(profile)),
+                               (cg.reverse_matrix(profile), rebuilt.reverse_matrix(profile))):
+            assert (patched != fresh).nnz == 0, profile
+
+
+def test_update_volumes_matches_rebuild():
+    check_update_matches_rebuild(compact=False)
+
+
+def test_update_volumes_matches_rebuild_compact():
+    check_update_matches_rebuild(compact=True)
+
+
+if __name__ == "__main__":
+    test_update_volumes_matches_rebuild()
+    test_update_volumes_matches_rebuild_compact()
+    print("update_volumes matches a full rebuild")
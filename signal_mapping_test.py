@@ -1,8 +1,10 @@
 import osmnx as ox
 import geopandas as gpd
-import pandas as pd
 import matplotlib.pyplot as plt
 
+from ring_engine import compile_graph
+from signal_delays import snap_signals
+
 # Load graph
 ox.settings.cache_folder = "cache_parkville"
 places = [
@@ -16,27 +18,9 @@ G = ox.graph_from_place(places, network_type="drive")
 # Load traffic lights
 traffic_lights = gpd.read_file("Traffic_Lights.geojson")
 
-# Store results
-records = []
-
-for _, row in traffic_lights.iterrows():
-    lon, lat = row.geometry.x, row.geometry.y
-    site_no = row["SITE_NO"]
-
-    # Find nearest node in graph
-    nearest_node = ox.distance.nearest_nodes(G, lon, lat)
-
-    # Save mapping
-    records.append({
-        "SITE_NO": site_no,
-        "node_id": nearest_node,
-        "node_lon": G.nodes[nearest_node]["x"],
-        "node_lat": G.nodes[nearest_node]["y"]
-    })
-
-# Save mapping CSV for debugging
-df_map = pd.DataFrame(records)
-df_map.to_csv("TrafficLight_Node_Mapping.csv", index=False)
+# Snap every light in one bulk query (also records snap distance + graph version)
+engine = compile_graph(G)
+df_map = snap_signals(engine, traffic_lights, "TrafficLight_Node_Mapping.csv")
 print("Saved mapping to TrafficLight_Node_Mapping.csv")
 print(df_map.head())
 
@@ -0,0 +1,245 @@
+import json
+import os
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+
+from graph_snapshot import SNAPSHOT_DIR
+from ring_engine import CompiledGraph, generate_bands, generate_ring, index_ranges
+
+TILE_SIZE = 5000  # cell side in meters
+
+
+# ----------------------------
+# Build
+# ----------------------------
+def _max_speed(cg, profile, px, py):
+    """Largest straight-line meters per second over any edge, so no path gets further than speed x time."""
+    src = cg.edge_sources()
+    dist = np.hypot(px[cg.indices] - px[src], py[cg.indices] - py[src])
+    w = cg.weights[profile]
+    moving = dist > 0
+    if (w[moving] <= 0).any():
+        return np.inf  # a free jump; every search has to see every cell
+    return float((dist[moving] / w[moving]).max(initial=0.0))
+
+
+def build_tiles(cg, path, tile_size=TILE_SIZE):
+    """Write `cg` to `path` as square cells of `tile_size` meters, one .npz per cell.
+
+    A cell holds its nodes (global index, OSM id, lon/lat, projected x/y),
+    their out-edges (global target index, every weight profile, geometry),
+    and nothing else. The root keeps a sorted OSM id -> global index lookup
+    and, per profile, the fastest straight-line speed over any edge, which
+    bounds how far a search can get within a cutoff.
+    """
+    px, py = cg.projected_xy()
+    offsets, pxy = cg.projected_edge_geometry()
+    origin = (float(px.min()), float(py.min()))
+    col = ((px - origin[0]) // tile_size).astype(np.int64)
+    row = ((py - origin[1]) // tile_size).astype(np.int64)
+    shape = (int(row.max()) + 1, int(col.max()) + 1)
+    cell = row * shape[1] + col
+
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    order = np.argsort(cell, kind="stable")  # nodes of one cell stay in global index order
+    bounds = np.searchsorted(cell[order], np.arange(shape[0] * shape[1] + 1))
+    cells = []
+    for c in range(shape[0] * shape[1]):
+        nodes = order[bounds[c]:bounds[c + 1]]
+        if len(nodes) == 0:
+            continue
+        edges = cg.out_edges(nodes)
+        starts, ends = offsets[edges], offsets[edges + 1]
+        vertices = index_ranges(offsets, edges)
+        geom_offsets = np.zeros(len(edges) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=geom_offsets[1:])
+        arrays = {
+            "nodes": nodes, "node_ids": cg.node_ids[nodes], "x": cg.x[nodes], "y": cg.y[nodes],
+            "px": px[nodes], "py": py[nodes], "degree": np.diff(cg.indptr)[nodes], "targets": cg.indices[edges],
+            "geom_offsets": geom_offsets, "geom_pxy": pxy[vertices],
+            **{f"weight.{k}": w[edges] for k, w in cg.weights.items()},
+        }
+        if cg.edge_geometry is not None:
+            arrays["geom_xy"] = cg.edge_geometry[1][vertices]
+        np.savez(os.path.join(tmp, f"cell_{c}.npz"), **arrays)
+        cells.append(c)
+
+    ids_order = np.argsort(cg.node_ids, kind="stable")
+    np.save(os.path.join(tmp, "sorted_ids.npy"), cg.node_ids[ids_order])
+    np.save(os.path.join(tmp, "sorted_index.npy"), ids_order.astype(np.int64))
+    np.save(os.path.join(tmp, "node_cell.npy"), cell.astype(np.int32))
+    info = {
+        "tile_size": tile_size, "origin": origin, "shape": shape, "cells": cells, "n_nodes": int(cg.n_nodes),
+        "max_speed": {k: _max_speed(cg, k, px, py) for k in cg.weights},
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(info, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return path
+
+
+def tiles_for(cg, tile_size=TILE_SIZE, max_cells=None):
+    """The TiledGraph next to `cg`'s snapshot, written first if missing."""
+    base = cg.path or os.path.join(SNAPSHOT_DIR, cg.key or cg.topology_hash())
+    path = os.path.join(base, f"tiles_{tile_size:g}")
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        build_tiles(cg, path, tile_size)
+    return TiledGraph(path, max_cells=max_cells)
+
+
+def with_tiles(cg, tile_size=None, max_cells=None):
+    """Attach cg.tiles when tile_size is set, so ring searches run on the reachable cells only."""
+    if tile_size:
+        cg.tiles = tiles_for(cg, tile_size, max_cells)
+    return cg
+
+
+# ----------------------------
+# Tiled Graph
+# ----------------------------
+class TiledGraph:
+    """Lazily loaded cells of a tiled graph; each search sees only the cells it can reach.
+
+    A node reached within `cutoff` lies within max_speed x cutoff of the
+    source in a straight line, and so does every node on the way, so the
+    cells meeting that disc (the halo) hold every path the full graph
+    search could use and the rings come out identical.
+
+    Loaded cells are kept least recently used first out, never fewer than
+    twice the largest halo searched so far, so a search never evicts the
+    cells it is about to use. Memory is therefore bounded by the halo, about
+    (2 x max_speed x cutoff / tile_size + 3)^2 cells: two halos of cells
+    plus up to `max_subgraphs` assembled subgraphs of one halo each. Tile
+    size alone does not bound it; a long cutoff on fast roads reaches many
+    cells. Halos are taken per cell, and an assembled subgraph is reused by
+    every later search whose halo it covers, so all facilities in a cell
+    (and nearby ones, searched in cell order) build it once.
+    """
+
+    def __init__(self, path, max_cells=None, max_subgraphs=2):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.info = json.load(f)
+        self.sorted_ids = np.load(os.path.join(path, "sorted_ids.npy"), mmap_mode="r")
+        self.sorted_index = np.load(os.path.join(path, "sorted_index.npy"), mmap_mode="r")
+        self.node_cell = np.load(os.path.join(path, "node_cell.npy"), mmap_mode="r")
+        self.max_cells = max_cells or 1  # grows to the largest halo searched
+        self.max_subgraphs = max_subgraphs
+        self._cells = OrderedDict()
+        self._subgraphs = OrderedDict()  # frozenset of cells -> CompiledGraph over them
+        self.loads = 0
+        self.builds = 0
+
+    def _cell(self, c):
+        if c in self._cells:
+            self._cells.move_to_end(c)
+            return self._cells[c]
+        with np.load(os.path.join(self.path, f"cell_{c}.npz")) as data:
+            arrays = dict(data)
+        self.loads += 1
+        self._cells[c] = arrays
+        while len(self._cells) > self.max_cells:
+            self._cells.popitem(last=False)
+        return arrays
+
+    def index_of(self, node):
+        """Global node index of OSM id `node`."""
+        i = np.searchsorted(self.sorted_ids, node)
+        if i >= len(self.sorted_ids) or self.sorted_ids[i] != node:
+            raise KeyError(node)
+        return int(self.sorted_index[i])
+
+    def cells_within(self, node, radius):
+        """Cells within `radius` meters of the cell holding OSM node `node`.
+
+        Measured from the whole cell rather than the node, so every node of
+        a cell gets the same halo and can share one subgraph.
+        """
+        size, (rows, cols) = self.info["tile_size"], self.info["shape"]
+        if not np.isfinite(radius):
+            return list(self.info["cells"])
+        sr, sc = divmod(int(self.node_cell[self.index_of(node)]), cols)
+        radius = radius * (1 + 1e-9) + 1.0  # slack for rounding in the speed bound
+        reach = int(radius // size) + 1
+        present = set(self.info["cells"])
+        found = []
+        for r in range(max(0, sr - reach), min(rows - 1, sr + reach) + 1):
+            for c in range(max(0, sc - reach), min(cols - 1, sc + reach) + 1):
+                # gap between the two cells
+                dx = max(abs(c - sc) - 1, 0) * size
+                dy = max(abs(r - sr) - 1, 0) * size
+                if dx * dx + dy * dy <= radius * radius and r * cols + c in present:
+                    found.append(r * cols + c)
+        return found
+
+    def subgraph(self, node, cutoff, profile):
+        """CompiledGraph over the cells a `cutoff` search from OSM node `node` can reach.
+
+        A kept subgraph covering all of them is reused as is; a larger one
+        gives the same rings, since every path within the cutoff is in it.
+        """
+        needed = frozenset(self.cells_within(node, self.info["max_speed"][profile] * cutoff))
+        for cells, sub in self._subgraphs.items():
+            if needed <= cells:
+                self._subgraphs.move_to_end(cells)
+                return sub
+        # room for two halos, so moving to a neighbouring halo only loads the cells it adds
+        self.max_cells = max(self.max_cells, 2 * len(needed))
+        sub = self._assemble(sorted(needed))
+        self._subgraphs[needed] = sub
+        while len(self._subgraphs) > self.max_subgraphs:
+            self._subgraphs.popitem(last=False)
+        return sub
+
+    def _assemble(self, cell_ids):
+        """CompiledGraph over the given cells.
+
+        Nodes keep their global order, so ties between equal times break the
+        same way as on the full graph. Edges leaving the cells are dropped;
+        they end beyond the halo and could never be reached in time.
+        """
+        self.builds += 1
+        cells = [self._cell(c) for c in cell_ids]
+        cat = {k: np.concatenate([c[k] for c in cells]) for k in cells[0] if k != "geom_offsets"}
+        edge_counts = np.concatenate([c["degree"] for c in cells])
+        geom_lengths = np.concatenate([np.diff(c["geom_offsets"]) for c in cells])
+
+        # back to global order, carrying each node's run of edges and vertices with it
+        order = np.argsort(cat["nodes"], kind="stable")
+        edge_order = index_ranges(np.concatenate([[0], np.cumsum(edge_counts)]), order)
+        nodes = cat["nodes"][order]
+        local = np.searchsorted(nodes, cat["targets"][edge_order])
+        local = np.minimum(local, len(nodes) - 1)
+        keep = nodes[local] == cat["targets"][edge_order]
+        kept = edge_order[keep]
+
+        source = np.repeat(np.arange(len(nodes)), edge_counts[order])[keep]
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(source, minlength=len(nodes)), out=indptr[1:])
+
+        vertices = index_ranges(np.concatenate([[0], np.cumsum(geom_lengths)]), kept)
+        offsets = np.zeros(len(kept) + 1, dtype=np.int64)
+        np.cumsum(geom_lengths[kept], out=offsets[1:])
+
+        profiles = [k[len("weight."):] for k in cat if k.startswith("weight.")]
+        sub = CompiledGraph(
+            cat["node_ids"][order], cat["x"][order], cat["y"][order], indptr, local[keep],
+            {k: cat[f"weight.{k}"][kept] for k in profiles},
+            edge_geometry=(offsets, cat["geom_xy"][vertices]) if "geom_xy" in cat else None,
+        )
+        sub._projected = (cat["px"][order], cat["py"][order])
+        sub._projected_geometry = (offsets, cat["geom_pxy"][vertices])
+        return sub
+
+    def ring(self, node, cutoff=20*60, profile="free_flow", mode="convex"):
+        """generate_ring on the reachable cells only; same result as on the whole graph."""
+        return generate_ring(self.subgraph(node, cutoff, profile), node, cutoff=cutoff, profile=profile, mode=mode)
+
+    def bands(self, node, cutoffs=(5*60, 10*60, 15*60, 20*60), profile="free_flow", mode="convex"):
+        return generate_bands(self.subgraph(node, max(cutoffs), profile), node, cutoffs=cutoffs, profile=profile,
+                              mode=mode)
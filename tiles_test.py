@@ -0,0 +1,93 @@
+import os
+import tempfile
+
+import numpy as np
+import shapely
+
+from parallel_rings import compute_bands, compute_rings
+from ring_engine import CompiledGraph, generate_bands, generate_ring
+from signal_delays import add_profile
+from tiles import TiledGraph, build_tiles
+
+MODES = ("convex", "concave", "edges")
+CUTOFFS = (45, 90, 180)
+TILE_SIZE = 300
+
+
+def lattice(n=50, seed=0):
+    """n x n streets ~100 m apart near Parkville, with jittered times, a few one-ways and one fast avenue."""
+    rng = np.random.default_rng(seed)
+    lon, lat = np.meshgrid(144.94 + 0.00114 * np.arange(n), -37.80 + 0.0009 * np.arange(n))
+    lon = lon.ravel() + rng.normal(0, 0.0001, n * n)
+    lat = lat.ravel() + rng.normal(0, 0.0001, n * n)
+
+    src, dst, seconds = [], [], []
+    for i in range(n * n):
+        r, c = divmod(i, n)
+        for j, ok in ((i - n, r > 0), (i + n, r < n - 1), (i - 1, c > 0), (i + 1, c < n - 1)):
+            if not ok or (r % 7 == 3 and j == i - 1):  # every 7th row is one-way eastbound
+                continue
+            src.append(i)
+            dst.append(j)
+            seconds.append((8.0 if r == n // 2 and j // n == r else 12.0) * rng.uniform(0.8, 1.2))
+
+    # each edge bends through a point beside its midpoint, so "edges" hulls follow the geometry
+    src, dst = np.array(src), np.array(dst)
+    mid_lon = (lon[src] + lon[dst]) / 2 + rng.normal(0, 0.00005, len(src))
+    mid_lat = (lat[src] + lat[dst]) / 2 + rng.normal(0, 0.00005, len(src))
+    xy = np.stack([np.column_stack([lon[src], lat[src]]), np.column_stack([mid_lon, mid_lat]),
+                   np.column_stack([lon[dst], lat[dst]])], axis=1).reshape(-1, 2)
+
+    ids = rng.permutation(n * n).astype(np.int64) * 7 + 1000  # OSM ids are not in index order
+    indptr = np.searchsorted(src, np.arange(n * n + 1))
+    cg = CompiledGraph(ids, lon, lat, indptr, dst, {"free_flow": np.array(seconds)},
+                       edge_geometry=(np.arange(0, 3 * len(src) + 1, 3), xy))
+    add_profile(cg, "peak", np.where(rng.random(n * n) < 0.1, 30.0, 0.0))
+    return cg
+
+
+def _same_ring(full, tiled):
+    assert full[0] == tiled[0]
+    assert len(full[1]) == len(tiled[1])
+    for a, b in zip(full[1].geometry, tiled[1].geometry):
+        assert shapely.equals_exact(a, b, tolerance=0), (a.area, b.area)
+
+
+def test_tiled_rings_match_full_graph():
+    cg = lattice()
+    sources = [int(node) for node in cg.node_ids[::97]]
+    with tempfile.TemporaryDirectory() as directory:
+        tiles = TiledGraph(build_tiles(cg, os.path.join(directory, "tiles"), TILE_SIZE))
+        assert len(tiles.info["cells"]) > 9
+        for profile in cg.profiles:
+            for mode in MODES:
+                for cutoff in CUTOFFS:
+                    for node in sources:
+                        full = generate_ring(cg, node, cutoff=cutoff, profile=profile, mode=mode)
+                        _same_ring(full, tiles.ring(node, cutoff=cutoff, profile=profile, mode=mode))
+                for node in sources:
+                    full = generate_bands(cg, node, cutoffs=CUTOFFS, profile=profile, mode=mode)
+                    _same_ring(full, tiles.bands(node, cutoffs=CUTOFFS, profile=profile, mode=mode))
+        assert len(tiles._cells) <= tiles.max_cells
+        assert len(tiles._subgraphs) <= tiles.max_subgraphs
+
+
+def test_tiled_rings_match_full_graph_in_a_pool():
+    cg = lattice(seed=1)
+    sources = [int(node) for node in cg.node_ids[::131]]
+    with tempfile.TemporaryDirectory() as directory:
+        tiled = lattice(seed=1)
+        tiled.tiles = TiledGraph(build_tiles(tiled, os.path.join(directory, "tiles"), TILE_SIZE))
+        for workers in (1, 2):
+            rings = compute_rings(tiled, sources, cutoff=180, profile="peak", mode="edges", workers=workers)
+            for node, ring in zip(sources, rings):
+                _same_ring(generate_ring(cg, node, cutoff=180, profile="peak", mode="edges"), ring)
+            bands = compute_bands(tiled, sources, cutoffs=CUTOFFS, mode="concave", workers=workers)
+            for node, band in zip(sources, bands):
+                _same_ring(generate_bands(cg, node, cutoffs=CUTOFFS, mode="concave"), band)
+
+
+if __name__ == "__main__":
+    test_tiled_rings_match_full_graph()
+    test_tiled_rings_match_full_graph_in_a_pool()
+    print("tiled rings match the full graph")
@@ -0,0 +1,197 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from graph_snapshot import SNAPSHOT_DIR, file_hash
+from isochrones import ring_polygon, to_lonlat
+from signal_delays import signal_delays
+
+DAY = 24 * 3600
+SLOT_SECONDS = 15 * 60
+SLOTS = DAY // SLOT_SECONDS  # 96 SCATS intervals, V00-V95
+INTERVALS_PER_WINDOW = 12    # the summary's peak / off-peak windows are 12 intervals (3 hours) long
+
+# same rule as the drive profiles; a slot's volume is put in the summary's units first
+DRIVE_RULE = {"per_vehicle": 1 / 200.0, "cap": 120, "default": 10}
+
+
+# ----------------------------
+# Delay Table
+# ----------------------------
+class DelayTable:
+    """Signal delay per 15-minute slot of the day, one row per signalised node with data.
+
+    `nodes` are node indices (int32), `delays` a (len(nodes), 96) float32
+    array of seconds; every other node gets `default`. Between slot
+    midpoints the delay is interpolated linearly, wrapping at midnight. A
+    slot-to-slot change is far under the 900 s slot length (delays are
+    capped at 2 minutes), so leaving later never means arriving earlier and
+    a label-setting or label-correcting search stays exact.
+    """
+
+    def __init__(self, nodes, delays, default, n_nodes, info=None):
+        self.nodes = np.asarray(nodes, dtype=np.int32)
+        self.delays = np.asarray(delays, dtype=np.float32)
+        self.default = float(default)
+        self.info = dict(info or {})
+        self.node_row = np.full(n_nodes, -1, dtype=np.int32)
+        self.node_row[self.nodes] = np.arange(len(self.nodes), dtype=np.int32)
+
+    @property
+    def nbytes(self):
+        return self.nodes.nbytes + self.delays.nbytes
+
+    def delay(self, nodes, t):
+        """Delay (s) at node indices `nodes` (m,) for clock times `t` (m, k) in seconds since midnight."""
+        row = self.node_row[nodes][:, None]
+        pos = np.mod(np.nan_to_num(t, posinf=0.0), DAY) / SLOT_SECONDS - 0.5
+        lo = np.floor(pos)
+        frac = pos - lo
+        lo = lo.astype(np.int64) % SLOTS
+        hi = (lo + 1) % SLOTS
+        safe = np.maximum(row, 0)
+        d = self.delays[safe, lo] * (1 - frac) + self.delays[safe, hi] * frac
+        return np.where(row >= 0, d, self.default)
+
+
+def build_delay_table(cg, intervals_parquet, rule=DRIVE_RULE):
+    """Per-slot delays for every signalised node from clean_volume_data's --intervals output.
+
+    The parquet holds each site's mean count per interval per day (V00-V95)
+    and its n_days; a slot's count is scaled by 12 intervals x n_days into
+    the monthly 3-hour totals the delay rules were tuned on, so the 3pm-6pm
+    slots land near the static peak profile.
+    """
+    means = pd.read_parquet(intervals_parquet).drop_duplicates("NB_SCATS_SITE", keep="last").set_index("NB_SCATS_SITE")
+    columns = [f"V{i:02d}" for i in range(SLOTS)]
+    signalised = np.flatnonzero(cg.node_attrs["site_no"] >= 0)
+    sites = cg.node_attrs["site_no"][signalised]
+    have = np.isin(sites, means.index)
+    nodes, sites = signalised[have], sites[have]
+
+    rows = means.loc[sites]
+    volume = rows[columns].to_numpy(dtype=np.float64) * (INTERVALS_PER_WINDOW * rows["n_days"].to_numpy()[:, None])
+    delays = signal_delays(volume.ravel(), **rule).reshape(volume.shape)
+    info = {"source": os.path.basename(intervals_parquet), "source_hash": file_hash(intervals_parquet), "rule": rule}
+    return DelayTable(nodes, delays, rule.get("default", 0.0), cg.n_nodes, info)
+
+
+# ----------------------------
+# Save / Load
+# ----------------------------
+def table_path(cg, root=SNAPSHOT_DIR):
+    """Delay table directory inside the graph's snapshot directory."""
+    base = cg.path or os.path.join(root, cg.key or cg.topology_hash())
+    return os.path.join(base, "td_delays")
+
+
+def save_delay_table(table, path):
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, "nodes.npy"), table.nodes)
+    np.save(os.path.join(tmp, "delays.npy"), table.delays)
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({**table.info, "default": table.default, "bytes": int(table.nbytes)}, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return path
+
+
+def load_delay_table(path, n_nodes, mmap_mode="r"):
+    """Memory-map a saved table, or None if it isn't there."""
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        info = json.load(f)
+    nodes = np.load(os.path.join(path, "nodes.npy"), mmap_mode=mmap_mode)
+    delays = np.load(os.path.join(path, "delays.npy"), mmap_mode=mmap_mode)
+    return DelayTable(nodes, delays, info.pop("default"), n_nodes, info)
+
+
+def delay_table_for(cg, intervals_parquet, rule=DRIVE_RULE):
+    """The saved table next to the graph, rebuilt when the interval file or rule changes."""
+    path = table_path(cg)
+    table = load_delay_table(path, cg.n_nodes)
+    if (table is None or table.info.get("source_hash") != file_hash(intervals_parquet)
+            or table.info.get("rule") != rule):
+        table = build_delay_table(cg, intervals_parquet, rule)
+        save_delay_table(table, path)
+    return table
+
+
+# ----------------------------
+# Time-Dependent Search
+# ----------------------------
+def clock_seconds(depart):
+    """Seconds since midnight from "HH:MM" or a number of seconds."""
+    if isinstance(depart, str):
+        hours, minutes = depart.split(":")
+        return int(hours) * 3600 + int(minutes) * 60
+    return float(depart)
+
+
+def sweep(cg, table, source, departures, cutoff=20*60, base="free_flow"):
+    """Travel times from node index `source` to every node, for every departure time at once.
+
+    Edge e leaving at clock time t costs base[e] plus the delays at both of
+    its ends at time t, the time-dependent form of add_profile's static
+    weights. Labels are (nodes, departures) arrays and the search is
+    label-correcting over a frontier: each round relaxes, for all departures
+    together, just the out-edges of nodes whose arrival improved in the last
+    round, so the whole day costs one sweep rather than one search per slot.
+    Returns a (n_nodes, len(departures)) array, inf beyond cutoff.
+    """
+    departures = np.atleast_1d(np.asarray(departures, dtype=np.float64))
+    arrival = np.full((cg.n_nodes, len(departures)), np.inf)
+    arrival[source] = departures
+    limit = departures + cutoff
+    weights = cg.weights[base]
+    degree = np.diff(cg.indptr)
+
+    frontier = np.array([source], dtype=np.int64)
+    while len(frontier):
+        edges = cg.out_edges(frontier)
+        src = np.repeat(frontier, degree[frontier])
+        dst = cg.indices[edges]
+        t = arrival[src]
+        candidate = t + weights[edges][:, None] + table.delay(src, t) + table.delay(dst, t)
+        candidate[candidate > limit] = np.inf
+        better = (candidate < arrival[dst]).any(axis=1)
+        np.minimum.at(arrival, dst[better], candidate[better])
+        frontier = np.unique(dst[better])
+    return arrival - departures
+
+
+def td_travel_times(cg, table, source, depart, cutoff=20*60, base="free_flow"):
+    """Travel time from node index `source` to every node when leaving at `depart` ("HH:MM" or seconds)."""
+    return sweep(cg, table, source, [clock_seconds(depart)], cutoff, base)[:, 0]
+
+
+def td_ring(cg, table, node, depart, cutoff=20*60, mode="convex", base="free_flow"):
+    """generate_ring for a departure time: (reachable_nodes, hull_gdf) from OSM node `node`."""
+    times = td_travel_times(cg, table, cg.node_index[node], depart, cutoff, base)
+    idx = np.flatnonzero(np.isfinite(times))
+    idx = idx[np.argsort(times[idx], kind="stable")]
+    hull = ring_polygon(cg, idx, mode=mode)
+    if hull.is_empty:
+        return cg.node_ids[idx].tolist(), gpd.GeoDataFrame(geometry=[])
+    return cg.node_ids[idx].tolist(), gpd.GeoDataFrame(geometry=[to_lonlat(hull)], crs="EPSG:4326")
+
+
+def rings_by_slot(cg, table, node, cutoff=20*60, mode="convex", slots=range(SLOTS), base="free_flow"):
+    """One ring per departure slot from a single sweep, as a GeoDataFrame with depart and reached columns."""
+    departures = np.array([s * SLOT_SECONDS for s in slots], dtype=np.float64)
+    times = sweep(cg, table, cg.node_index[node], departures, cutoff, base)
+    hulls, reached = [], []
+    for k in range(len(departures)):
+        idx = np.flatnonzero(np.isfinite(times[:, k]))
+        hulls.append(to_lonlat(ring_polygon(cg, idx, mode=mode)))
+        reached.append(len(idx))
+    labels = [f"{int(d) // 3600:02d}:{int(d) % 3600 // 60:02d}" for d in departures]
+    return gpd.GeoDataFrame({"depart": labels, "reached": reached}, geometry=hulls, crs="EPSG:4326")
@@ -0,0 +1,115 @@
+import json
+
+import numpy as np
+import folium
+import shapely
+
+from isochrones import PROJECTED_CRS, to_lonlat
+
+WEB_BUDGET = 4_000_000  # bytes of GeoJSON embedded in the page
+
+# (simplification tolerance in meters, decimal places kept), finest first;
+# 5 places is ~1.1 m and 4 places ~11 m at Melbourne's latitude
+WEB_LEVELS = ((0.5, 6), (1, 5), (2, 5), (5, 5), (10, 4), (20, 4), (50, 4))
+
+
+# ----------------------------
+# Geometry Prep
+# ----------------------------
+def network_lines(cg):
+    """The street network as one merged MultiLineString in PROJECTED_CRS.
+
+    A two-way street is stored as two opposite edges; only one is kept, then
+    the segments are merged into runs between junctions so that shared
+    vertices are written once.
+    """
+    src, dst = cg.edge_sources().astype(np.int64), cg.indices.astype(np.int64)
+    pair, reverse = src * cg.n_nodes + dst, dst * cg.n_nodes + src
+    keep = np.flatnonzero((src < dst) | ~np.isin(reverse, pair))
+
+    offsets, pxy = cg.projected_edge_geometry()
+    counts = offsets[keep + 1] - offsets[keep]
+    take = np.repeat(offsets[keep] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    lines = shapely.linestrings(pxy[take], indices=np.repeat(np.arange(len(keep)), counts))
+    return shapely.line_merge(shapely.multilinestrings(lines))
+
+
+def _web_geometry(geom, tolerance, precision):
+    """Simplify a PROJECTED_CRS geometry, return it in lon/lat rounded to `precision` places."""
+    geom = to_lonlat(shapely.simplify(geom, tolerance))
+    geom = shapely.transform(geom, lambda xy: np.round(xy, precision))
+    return shapely.remove_repeated_points(geom)
+
+
+def _feature(geom, properties):
+    return {"type": "Feature", "properties": properties, "geometry": geom.__geo_interface__}
+
+
+# ----------------------------
+# Web Layers
+# ----------------------------
+def web_layers(cg, lons, lats, rings, budget=WEB_BUDGET):
+    """GeoJSON FeatureCollections for the network, rings and markers within `budget` bytes.
+
+    Walks WEB_LEVELS from finest to coarsest and keeps the first level whose
+    serialized size fits. `rings` are generate_ring or generate_bands results
+    in the order of the markers. Returns (layers, info) where info records
+    the chosen level and its size.
+    """
+    network = network_lines(cg)
+    hulls = []
+    for i, (_, hull_gdf) in enumerate(rings):
+        if hull_gdf.empty:
+            continue
+        cutoffs = hull_gdf["cutoff"].tolist() if "cutoff" in hull_gdf else [None] * len(hull_gdf)
+        for geom, cutoff in zip(hull_gdf.to_crs(PROJECTED_CRS).geometry, cutoffs):
+            hulls.append((geom, {"facility": i, "cutoff": cutoff}))
+    markers = {
+        "type": "FeatureCollection",
+        "features": [
+            _feature(shapely.Point(round(lon, 6), round(lat, 6)), {"facility": i})
+            for i, (lon, lat) in enumerate(zip(lons, lats))
+        ],
+    }
+
+    for tolerance, precision in WEB_LEVELS:
+        layers = {
+            "network": {
+                "type": "FeatureCollection",
+                "features": [_feature(_web_geometry(network, tolerance, precision), {})],
+            },
+            "rings": {
+                "type": "FeatureCollection",
+                "features": [_feature(_web_geometry(g, tolerance, precision), p) for g, p in hulls],
+            },
+            "markers": markers,
+        }
+        size = sum(len(json.dumps(layer, separators=(",", ":"))) for layer in layers.values())
+        if size <= budget:
+            break
+    info = {"bytes": size, "budget": budget, "tolerance_m": tolerance, "precision": precision,
+            "fits": size <= budget}
+    return layers, info
+
+
+def export_web_map(cg, lons, lats, rings, path, budget=WEB_BUDGET):
+    """Write an interactive folium page of the network, rings and facility markers."""
+    layers, info = web_layers(cg, lons, lats, rings, budget)
+    m = folium.Map(location=[float(np.mean(cg.y)), float(np.mean(cg.x))], zoom_start=13)
+    m.fit_bounds([[float(np.min(cg.y)), float(np.min(cg.x))], [float(np.max(cg.y)), float(np.max(cg.x))]])
+
+    folium.GeoJson(
+        layers["network"], name="network",
+        style_function=lambda f: {"color": "dimgrey", "weight": 1}, interactive=False,
+    ).add_to(m)
+    folium.GeoJson(
+        layers["rings"], name="rings",
+        style_function=lambda f: {"fillColor": "blue", "color": "darkblue", "weight": 1, "fillOpacity": 0.1},
+    ).add_to(m)
+    folium.GeoJson(
+        layers["markers"], name="facilities",
+        marker=folium.CircleMarker(radius=4, fill=True, color="white", weight=1, fill_color="red", fill_opacity=1),
+    ).add_to(m)
+    folium.LayerControl().add_to(m)
+    m.save(path)
+    return info